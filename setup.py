@@ -23,4 +23,6 @@ setup(name='xmimsim',
     long_description_content_type='text/markdown',
     license='see LICENSE.txt',
     keywords="xmimsim xmi msim xrf fluorescence x-ray xray simulation",
-    packages= find_packages(exclude='docs'))
+    packages= find_packages(exclude='docs'),
+    install_requires=['numpy'],
+    entry_points={'console_scripts': ['xmimsim-sweep = xmimsim.cli:main']})
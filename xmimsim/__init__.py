@@ -2,3 +2,23 @@
 
 from .version import __version__
 from .xmimsim import *
+from .result import Result
+from .aio import calculate_async, calculate_many_async, iter_many_async
+from .sweep import sweep, iter_sweep, grid, grid_from, derive, apply_variant, unique
+from .scheduler import ThreadBudget
+from .xmso import read_xmso, iter_xmso
+from .spectrum import Spectrum, count_bands, band_weights
+from .shard import shards, merge_xmso, merge_shards, calculate_sharded, calculate_adaptive
+from .store import SpectrumStore
+from . import response
+from .noise import realizations
+from .cache import ResultCache
+from .canonical import canonical
+from .emit import emit_xmsi
+from .spec import ModelSpec, FrozenDict
+from .profile import Profile, profiling, add_hook, remove_hook
+from .stream import Stalled, progress
+from .precomputed import PrecomputedData
+from .workqueue import WorkQueue
+from .cost import CostModel
+from .crn import paired, Difference
@@ -0,0 +1,188 @@
+import asyncio, collections, contextlib, itertools, os, subprocess, threading, time
+from .result import Result
+from .profile import timed
+from .stream import Stalled, take_line, TAIL
+
+
+async def calculate_async(xm, bands=None, timeout=None, semaphore=None, save_xmsi=True,
+                          save_xmso=False, progress=None, stall_timeout=None, **kwargs):
+    """
+    asyncio counterpart of model.calculate()
+    
+    Usage
+    -------------
+    result = await xmimsim.calculate_async(xm, bands={'k_a_Fe':[6.098,6.744]}, timeout=600)
+    result.spectrum, result.counts
+    
+    Arguments
+    -------------
+    bands: optional dictionary in the format of model.count_photons(**bands)
+    timeout: seconds (including the wait for the data files of data) after which
+     XMI-MSIM is killed and asyncio.TimeoutError raised
+    semaphore: an asyncio.Semaphore shared by all jobs that should count towards
+     the same concurrency limit (see xmimsim.calculate_many_async())
+    progress, stall_timeout: as for model.calculate(); the output is not printed
+    data: a xmimsim.PrecomputedData, as for model.calculate()
+    **kwargs: all options of model.calculate()
+    
+    Cancelling the task kills the XMI-MSIM child process before the
+    CancelledError is passed on. Unlike calculate(), a failing run raises.
+    """
+    start = time.time()
+    async with (semaphore if semaphore is not None else contextlib.nullcontext()):
+        if xm.prepare(**kwargs):
+            data = kwargs.get('data')
+            loop = asyncio.get_running_loop()
+            deadline = None if timeout is None else loop.time() + timeout
+            try:
+                held = await _acquire(data, data.files(xm, **kwargs).values(), timeout) if data else []
+            except BaseException:
+                # never ran: drop the staging folder without keeping anything
+                xm.returncode = None
+                if hasattr(xm, '_staged'): xm.cleanup()
+                raise
+            try:
+                with timed('simulate', xm) as event:
+                    await _simulate(xm, None if deadline is None else max(deadline - loop.time(), 0),
+                                    progress, stall_timeout)
+                    event['returncode'] = xm.returncode
+            finally:
+                if held: data.release(held, ok=not getattr(xm, 'returncode', 1))
+            with timed('collect', xm):
+                xm.cleanup(save_xmsi, save_xmso)
+    # parsing is plain file work, keep it off the event loop
+    loop = asyncio.get_running_loop()
+    spectrum = await loop.run_in_executor(None, xm.get_spectrum)
+    counts = xm.count_photons(**bands) if bands else None
+    return Result(xm, spectrum, counts, elapsed=time.time()-start)
+
+
+async def _acquire(data, paths, timeout):
+    """
+    data.acquire(paths) in a thread, so waiting for (or taking over) computing
+    the shared data files doesn't block the loop. The thread can't be stopped:
+    if the wait is cancelled or times out, the locks it still gets are given
+    back by it, those it already got are given back here
+    """
+    lock = threading.Lock()
+    state = {'abandoned': False, 'held': None}
+    def acquire():
+        held = data.acquire(paths)
+        with lock:
+            if not state['abandoned']:
+                state['held'] = held
+                return
+        data.release(held, ok=False)
+    try:
+        await asyncio.wait_for(asyncio.shield(asyncio.get_running_loop().run_in_executor(None, acquire)), timeout)
+    except BaseException:
+        with lock:
+            state['abandoned'] = True
+            held, state['held'] = state['held'], None
+        if held: data.release(held, ok=False)
+        raise
+    return state['held']
+
+
+async def _lines(process, stall_timeout):
+    while True:
+        try:
+            line = await asyncio.wait_for(process.stdout.readline(), stall_timeout)
+        except asyncio.TimeoutError:
+            raise Stalled('no output from XMI-MSIM for {} s'.format(stall_timeout)) from None
+        if not line:
+            break
+        yield line.decode(errors='replace').rstrip('\r\n')
+
+
+async def _follow(xm, process, progress, stall_timeout):
+    xm.output = collections.deque(maxlen=TAIL)
+    async for line in _lines(process, stall_timeout):
+        take_line(xm, line, progress)
+    await process.wait()
+
+
+async def _simulate(xm, timeout, progress=None, stall_timeout=None):
+    """runs xm.cmd, killing it on timeout, stall or cancellation"""
+    cmd = xm.cmd + (['--verbose'] if progress or stall_timeout else [])
+    if os.name=='nt':
+        process = await asyncio.create_subprocess_shell(subprocess.list2cmdline(cmd),
+                                                        stdout=subprocess.PIPE,
+                                                        stderr=subprocess.STDOUT)
+    else:
+        process = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.PIPE,
+                                                       stderr=subprocess.STDOUT)
+    try:
+        await asyncio.wait_for(_follow(xm, process, progress, stall_timeout), timeout)
+    except BaseException:
+        # timeout or cancellation: don't leave the simulation running
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        xm.returncode = process.returncode
+        if hasattr(xm, '_staged'): xm.cleanup()
+        raise
+    xm.returncode = process.returncode
+    if process.returncode:
+        if hasattr(xm, '_staged'): xm.cleanup()
+        raise RuntimeError('XMI-MSIM exited with code {} for {}: {}'.format(
+            process.returncode, xm.filelocation, '\n'.join(xm.output).strip()))
+
+
+async def calculate_many_async(models, concurrency=None, bands=None, timeout=None, **kwargs):
+    """
+    Runs calculate_async() for every model with at most concurrency simulations
+    (default os.cpu_count()) running at once. Returns a list of xmimsim.Result in
+    the order of models; a failed or timed out job has its exception in result.error
+    """
+    semaphore = asyncio.Semaphore(concurrency or os.cpu_count())
+    async def job(xm):
+        start = time.time()
+        try:
+            return await calculate_async(xm, bands=bands, timeout=timeout, semaphore=semaphore, **kwargs)
+        except Exception as error:
+            return Result(xm, error=error, elapsed=time.time()-start)
+    return await asyncio.gather(*[job(xm) for xm in models])
+
+
+async def iter_many_async(models, concurrency=None, backlog=None, bands=None, timeout=None, **kwargs):
+    """
+    calculate_many_async() as an async generator: yields every xmimsim.Result as
+    soon as it is done, with result.index the position of its model
+    
+    async for xm, spectrum, counts in xmimsim.iter_many_async(models, concurrency=8):
+        ...
+    
+    models may be any iterable and is only read as far as needed: at most
+    concurrency simulations run and at most backlog (default concurrency)
+    results wait to be taken. Leaving the loop early cancels (and kills) the
+    running simulations.
+    """
+    concurrency = concurrency or os.cpu_count()
+    limit = concurrency + (concurrency if backlog is None else backlog)
+    semaphore = asyncio.Semaphore(concurrency)
+    models = iter(enumerate(models))
+    async def job(n, xm):
+        start = time.time()
+        try:
+            result = await calculate_async(xm, bands=bands, timeout=timeout, semaphore=semaphore, **kwargs)
+        except Exception as error:
+            result = Result(xm, error=error, elapsed=time.time()-start)
+        result.index = n
+        return result
+    pending = set()
+    try:
+        while True:
+            for n, xm in itertools.islice(models, limit - len(pending)):
+                pending.add(asyncio.ensure_future(job(n, xm)))
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+
@@ -0,0 +1,142 @@
+import os, shutil, tempfile, threading
+from .func import move_file
+
+
+class ResultCache():
+    """
+    Size bounded, content addressed cache of XMI-MSIM results
+    
+    Usage
+    -------------
+    cache = xmimsim.ResultCache('/scratch/xmi-cache', max_bytes=50e9)
+    xm.calculate(cache=cache)
+    cache.stats()
+    
+    With a cache, calculate() names the results by a key over everything that
+    changes them: the canonical form of the model, every physics and computation
+    flag, the export format and any seed tag (see model.key()). Runs happen in a
+    private staging folder inside root (or in the scratch folder of
+    calculate(scratch=...)) and their results are moved into root atomically, so
+    concurrent workers never see half written files. Results
+    that are read are touched, and once root holds more than max_bytes the least
+    recently used files are removed until it holds low_water*max_bytes, so not
+    every put has to evict.
+
+    The size of root is counted along with the puts and only worked out from
+    the files again (a scan of root, slow on NFS) when the count goes over
+    max_bytes or after rescan_every puts, which picks up what other processes
+    sharing root have put in meanwhile.
+    
+    The statistics count the lookups, puts and evictions of this instance.
+    """
+    def __init__(self, root, max_bytes=None, low_water=0.9, rescan_every=100):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.rescan_every = rescan_every
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.evictions = 0
+        self._bytes = None # unknown until the first scan
+        self._unscanned = 0
+        self._scanning = False
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(self.root, '.staging'), exist_ok=True)
+
+    def location(self, key):
+        """path of the results of key, without extension (like model.filelocation)"""
+        return os.path.join(self.root, key)
+
+    def lookup(self, key, extension):
+        """path of the cached file, or None. A hit counts as a use for the LRU order"""
+        path = '{}.{}'.format(self.location(key), extension)
+        try:
+            os.utime(path)
+        except OSError:
+            with self._lock: self.misses += 1
+            return None
+        with self._lock: self.hits += 1
+        return path
+
+    def staging(self, scratch=None):
+        """a new private folder inside root (or the scratch folder) to run a simulation in"""
+        return tempfile.mkdtemp(dir=scratch or os.path.join(self.root, '.staging'))
+
+    def put(self, key, file, extension):
+        """atomically moves file into the cache as the extension result of key"""
+        path = '{}.{}'.format(self.location(key), extension)
+        size = os.path.getsize(file)
+        move_file(file, path)
+        with self._lock:
+            self.puts += 1
+            if self.max_bytes is None:
+                return path
+            if self._bytes is not None:
+                self._bytes += size
+            self._unscanned += 1
+            if self._scanning or not (self._bytes is None or self._bytes > self.max_bytes
+                                      or self._unscanned >= self.rescan_every):
+                return path
+            #one thread scans, the others keep counting
+            self._scanning = True
+        try:
+            self.evict()
+        finally:
+            with self._lock: self._scanning = False
+        return path
+
+    def discard(self, staging):
+        shutil.rmtree(staging, ignore_errors=True)
+
+    def entries(self):
+        """(last use, size, path) of every cached file"""
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.is_file():
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self, max_bytes=None):
+        """
+        scans root and removes the least recently used files until the cache fits
+        in max_bytes (default: low_water*max_bytes if it holds more than max_bytes)
+        """
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        if max_bytes is None:
+            max_bytes = self.low_water*self.max_bytes if self.max_bytes is not None and total > self.max_bytes else total
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            with self._lock: self.evictions += 1
+        with self._lock:
+            self._bytes = total
+            self._unscanned = 0
+        return total
+
+    def stats(self):
+        entries = self.entries()
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'puts': self.puts,
+                'evictions': self.evictions, 'hit_rate': self.hits/lookups if lookups else None,
+                'files': len(entries), 'bytes': sum(size for _, size, _ in entries)}
+
+    def __getstate__(self):
+        # the lock can't be pickled, e.g. when a model is sent to another process
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
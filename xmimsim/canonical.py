@@ -0,0 +1,78 @@
+import functools, json
+from string import Formatter
+from .strings import s_main
+from .func import freeze
+
+
+# sections that full_parameters() renders into self.parameters
+SECTIONS = ('layers', 'excitation_path', 'detector_path', 'crystal', 'excitation')
+PARAMETER_DEFAULTS = {'collimator_height': 0, 'collimator_diameter': 0, 'detector_zero': 0}
+SOURCE_DEFAULTS = {'sigma_x': 0, 'sigma_y': 0, 'sigma_xp': 0, 'sigma_yp': 0}
+PARAMETERS = [field for _, field, _, _ in Formatter().parse(s_main) if field and field not in SECTIONS]
+
+
+def number(value):
+    """
+    one spelling for every number: 0.1, '1e-1' and 1e-01 all become '0.1'. Values
+    are rounded to 12 significant digits so that e.g. normalized weight fractions
+    that only differ by floating point error compare equal
+    """
+    try:
+        return '{:.12g}'.format(float(value))
+    except (TypeError, ValueError):
+        return str(value).strip()
+
+
+def layer(layer):
+    """a layer with its elements sorted by atomic number and weight fractions summing to 1"""
+    return _layer(freeze(layer))
+
+
+def source(source):
+    return _source(freeze(source))
+
+
+@functools.lru_cache(maxsize=65536)
+def _layer(frozen):
+    layer = dict(frozen)
+    elements = dict(layer['elements'])
+    total = float(sum(elements.values()))
+    return {'elements': [[int(z), number(elements[z]/total)] for z in sorted(elements, key=int)],
+            'density': number(layer['density']), 'thickness': number(layer['thickness'])}
+
+
+@functools.lru_cache(maxsize=65536)
+def _source(frozen):
+    return {k: number(v) for k, v in sorted(dict(SOURCE_DEFAULTS, **dict(frozen)).items())}
+
+
+def canonical(xm, exclude=(), memo=None):
+    """
+    Canonical serialization of a model: equivalent models give the same string
+    
+    Normalized are the order of the elements in a layer, their weight fractions
+    (masses=[50,50] is masses=[1,1]), the spelling of numbers (0.1 vs 1e-1) and
+    the defaults (a missing collimator_height is 0, a missing sigma_x is 0).
+    The order of layers and sources matters and is kept. Parameters in exclude
+    are left out, e.g. the detector parameters in python_detector mode.
+    
+    memo optionally maps id() of layers and sources that are known not to have
+    changed to their canonical form (see memo()), which saves recomputing them
+    when serializing many variants of one model.
+    """
+    memo = memo or {}
+    parameters = dict(PARAMETER_DEFAULTS, **xm.parameters)
+    data = {'parameters': {k: number(parameters[k]) for k in PARAMETERS
+                           if k in parameters and k not in exclude},
+            'sources': [memo[id(s)] if id(s) in memo else source(s) for s in xm.sources]}
+    for section in ('layers', 'excitation_path', 'detector_path', 'crystal'):
+        data[section] = [memo[id(l)] if id(l) in memo else layer(l) for l in getattr(xm, section)]
+    return json.dumps(data, sort_keys=True, separators=(',', ':'))
+
+
+def memo(xm):
+    """canonical forms of the layers and sources of xm by id(), for canonical(memo=...)"""
+    memo = {id(s): source(s) for s in xm.sources}
+    for section in ('layers', 'excitation_path', 'detector_path', 'crystal'):
+        memo.update({id(l): layer(l) for l in getattr(xm, section)})
+    return memo
@@ -0,0 +1,207 @@
+"""
+xmimsim-sweep: runs a sweep defined in a json file, and picks up where it
+stopped when it is started again
+
+xmimsim-sweep sweep.json [--max-workers N] [--retry-failed] [--journal FILE] [--results FILE]
+python -m xmimsim sweep.json ...
+
+The definition looks like
+{
+ "parameters": {"n_photons_line": 100000, "d_sample_source": 100, ...},
+ "orientation": {"sample_orientation": {"rthetaphi": [1, 335, 0]},
+                 "detector_orientation": {"rthetaphi": [1, 135, 0]},
+                 "detector_window": {"xyz": [0, 5.6, 0]}},
+ "sources": [{"energy": 13.5, "horizontal_intensity": "1e+012", "vertical_intensity": "1e+009"}],
+ "layers": [{"symbols": ["As", "Fe"], "masses": [50, 50], "density": 7.31, "thickness": 0.01}],
+ "excitation_path": [...], "detector_path": [...], "crystal": [...],
+ "axes": {"layers.0.thickness": [0.01, 0.02], "n_photons_line": [1e5, 1e6]},
+ "variants": [{"sources.0.energy": 17.4}],
+ "bands": {"k_a_Fe": [6.098, 6.744]},
+ "options": {"set_threads": 4, "M_lines": false, "xmifolder": "xmi"}
+}
+The points are the grid of "axes" followed by the explicit "variants" (either
+can be left out); "section.index.key" names a value of a layer or source.
+"options" are handed to calculate().
+
+Every finished point is appended to the journal (sweep.journal.jsonl) and to the
+results table (sweep.results.csv, one row per point with its model.key(), the
+axes, the band counts, the file and the time) as soon as it is done. If the
+definition has other columns than the table (e.g. a new axis), the table is
+rewritten once with the new header, the old rows leaving the new columns empty. Points in the journal
+are skipped when the sweep is run again, failed ones only with --retry-failed.
+Points are identified by model.key(), so editing the definition only runs the
+points that are new.
+"""
+import argparse, csv, json, os, sys, tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .xmimsim import model
+from .sweep import derive, grid_from, run_job, unique, _SECTIONS
+
+LAYER_SECTIONS = {'layers': 'add_layer', 'excitation_path': 'add_excitation_path_layer',
+                  'detector_path': 'add_detector_path_layer', 'crystal': 'add_crystal_layer'}
+
+
+def axis(name):
+    """'layers.1.thickness' -> ('layers', 1, 'thickness'), parameters stay as they are"""
+    parts = name.split('.')
+    if len(parts) == 3 and parts[0] in _SECTIONS:
+        return (parts[0], int(parts[1]), parts[2])
+    return name
+
+
+def model_from_dict(definition):
+    """the base xmimsim.model of a sweep definition"""
+    xm = model()
+    xm.set_parameters(**definition.get('parameters', {}))
+    for method, kwargs in definition.get('orientation', {}).items():
+        getattr(xm, method)(**kwargs)
+    for source in definition.get('sources', []):
+        xm.add_source(**source)
+    for section, method in LAYER_SECTIONS.items():
+        for layer in definition.get(section, []):
+            getattr(xm, method)(**layer)
+    return xm
+
+
+def points_from_dict(definition):
+    """the variants of a sweep definition, with the axis names as given"""
+    points = grid_from(definition['axes']) if definition.get('axes') else []
+    points += definition.get('variants', [])
+    return points or [{}]
+
+
+class Journal():
+    """append-only json lines of the finished points, flushed to disk line by line"""
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """{key: last entry}, ignoring a line cut off by a crash"""
+        entries = {}
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    entries[entry['key']] = entry
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def record(self, entry):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class ResultsTable():
+    """
+    the csv of the results, appended row by row. An existing table with other
+    columns is rewritten with columns (plus the old columns that are no longer
+    in it), so that every row matches the header
+    """
+    def __init__(self, path, columns):
+        self.path = path
+        header, rows = None, []
+        if os.path.isfile(path) and os.path.getsize(path) > 0:
+            with open(path, newline='') as f:
+                reader = csv.DictReader(f)
+                header, rows = reader.fieldnames, list(reader)
+        self.columns = columns + [column for column in header or [] if column not in columns]
+        if header != self.columns:
+            self._rewrite(rows)
+
+    def _rewrite(self, rows):
+        """writes the header and rows (dicts) to a new file that replaces the table"""
+        handle, partial = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+        with os.fdopen(handle, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.columns)
+            for row in rows:
+                writer.writerow([row.get(column) or '' for column in self.columns])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(partial, self.path)
+
+    def _write(self, row):
+        with open(self.path, 'a', newline='') as f:
+            csv.writer(f).writerow(row)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def add(self, entry, point):
+        values = {**point, **(entry.get('counts') or {}), **entry}
+        self._write([values.get(column, '') for column in self.columns])
+
+
+def run(path, max_workers=None, retry_failed=False, journal=None, results=None, log=print):
+    """runs (or resumes) the sweep defined in the json file path, returns the number of failed points"""
+    with open(path) as f:
+        definition = json.load(f)
+    stem = os.path.splitext(path)[0]
+    journal = Journal(journal or stem + '.journal.jsonl')
+    bands = definition.get('bands')
+    options = definition.get('options', {})
+    base = model_from_dict(definition)
+    points = points_from_dict(definition)
+    names = list(dict.fromkeys(name for point in points for name in point))
+    table = ResultsTable(results or stem + '.results.csv',
+                         ['key', 'status'] + names + list(bands or {}) + ['file', 'elapsed', 'error'])
+
+    jobs = [derive(base, {axis(name): value for name, value in point.items()}, n) for n, point in enumerate(points)]
+    firsts, index = unique(jobs, **options)
+    keys = [xm.key(**options) for xm in firsts]
+    finished = journal.load()
+    todo = [n for n, key in enumerate(keys)
+            if key not in finished or (retry_failed and finished[key]['status'] == 'failed')]
+    log('{} points, {} distinct, {} already done, {} to run'.format(
+        len(points), len(firsts), len(firsts) - len(todo), len(todo)))
+
+    def finish(n, result):
+        entry = {'key': keys[n], 'status': 'done' if result.ok else 'failed',
+                 'file': getattr(result.model, 'filelocation', None), 'elapsed': result.elapsed,
+                 'counts': result.counts, 'error': None if result.ok else repr(result.error)}
+        journal.record(entry)
+        for point, i in enumerate(index):
+            if i == n:
+                table.add(entry, points[point])
+        return entry
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+        futures = {pool.submit(run_job, firsts[n], bands, **options): n for n in todo}
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                entry = finish(futures[future], future.result())
+                failed += entry['status'] == 'failed'
+                log('[{}/{}] {} {} {}'.format(done, len(todo), entry['status'], entry['key'][:12],
+                                              entry['error'] or ''))
+        except KeyboardInterrupt:
+            for future in futures: future.cancel()
+            log('interrupted, run again to resume')
+            raise
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='xmimsim-sweep', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('definition', help='json file defining the sweep')
+    parser.add_argument('--max-workers', type=int, default=None,
+                        help='simulations at once (default: number of cores), mind set_threads')
+    parser.add_argument('--retry-failed', action='store_true', help='run the failed points again')
+    parser.add_argument('--journal', default=None, help='default: DEFINITION.journal.jsonl')
+    parser.add_argument('--results', default=None, help='default: DEFINITION.results.csv')
+    args = parser.parse_args(argv)
+    try:
+        failed = run(args.definition, args.max_workers, args.retry_failed, args.journal, args.results)
+    except KeyboardInterrupt:
+        return 130
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
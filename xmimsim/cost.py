@@ -0,0 +1,126 @@
+import heapq, json, math, os, threading
+import numpy as np
+
+# log-linear model: log(seconds) = intercept + sum(coefficient * feature)
+FEATURES = ('log_photons', 'log_interactions', 'log_layers', 'log_sources', 'advanced_compton', 'log_threads')
+# what the coefficients are pulled towards while there are few observations:
+# the time grows with photons x interactions, half as fast with the layers
+PRIOR = np.array([1., 1., .5, 0., .7, -.7])
+
+
+def features(xm, advanced_compton=False, set_threads='max', **kwargs):
+    """the features of the cost model for a run of xm with the options of calculate()"""
+    p = xm.parameters
+    layers = sum(len(getattr(xm, section)) for section in ('layers', 'excitation_path', 'detector_path', 'crystal'))
+    threads = os.cpu_count() if set_threads == 'max' else set_threads
+    photons = float(p.get('n_photons_line', 1)) * max(len(xm.sources), 1)
+    return [math.log(max(photons, 1)), math.log(max(float(p.get('n_interactions_trajectory', 1)), 1)),
+            math.log(max(layers, 1)), math.log(max(len(xm.sources), 1)),
+            1. if advanced_compton else 0., math.log(max(int(threads), 1))]
+
+
+class CostModel():
+    """
+    Predicts the run time of a simulation from what it was measured to be for others
+
+    Usage
+    -------------
+    cost = xmimsim.CostModel('runtimes.jsonl')   # the measurements are kept in the file
+    cost.eta(models, workers=8, set_threads=4)   # seconds the batch will take, None if untrained
+    results = xmimsim.sweep(xm, variants, max_workers=8, cost=cost, set_threads=4)
+
+    With cost, sweep() starts the longest jobs first, so the batch doesn't end
+    with one big job running alone, and adds the run times it measures.
+
+    The model is log(seconds) = a + b.features, with the features of
+    xmimsim.cost.features(): log photons (n_photons_line x sources), log
+    n_interactions_trajectory, log layers, log sources, advanced_compton and log
+    threads. It is fitted by least squares, pulled a little towards photons x
+    interactions so that it is usable after a handful of runs. Runs that failed
+    or found their results on disk don't tell anything and are not recorded.
+    """
+    def __init__(self, path=None, regularization=0.1):
+        self.path = path
+        self.regularization = regularization
+        self.observations = []
+        self._coefficients = None
+        self._lock = threading.Lock()
+        if path is not None and os.path.isfile(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.observations.append((entry['features'], entry['seconds']))
+
+    def observe(self, xm, seconds, **kwargs):
+        """records that a run of xm with the options of calculate() took seconds"""
+        x = features(xm, **kwargs)
+        with self._lock:
+            self.observations.append((x, seconds))
+            self._coefficients = None
+            if self.path is not None:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps({'features': x, 'seconds': seconds}) + '\n')
+
+    def record(self, results, **kwargs):
+        """observe() for the successful xmimsim.Result of a batch that actually ran"""
+        for result in results:
+            if result.ok and result.elapsed and getattr(result.model, 'returncode', None) == 0:
+                self.observe(result.model, result.elapsed, **kwargs)
+
+    def fit(self):
+        """(intercept, coefficients) of the least squares fit, None without observations"""
+        with self._lock:
+            if self._coefficients is None and self.observations:
+                x = np.array([[1.] + list(f) for f, _ in self.observations])
+                y = np.log([max(s, 1e-6) for _, s in self.observations])
+                #ridge rows pulling the coefficients (not the intercept) to the prior
+                r = math.sqrt(self.regularization)
+                x = np.vstack([x, np.hstack([np.zeros((len(PRIOR), 1)), r*np.eye(len(PRIOR))])])
+                y = np.concatenate([y, r*PRIOR])
+                solution = np.linalg.lstsq(x, y, rcond=None)[0]
+                self._coefficients = (float(solution[0]), solution[1:])
+            return self._coefficients
+
+    def predict(self, xm, **kwargs):
+        """predicted seconds of a run of xm with the options of calculate(), None if untrained"""
+        fit = self.fit()
+        if fit is None:
+            return None
+        intercept, coefficients = fit
+        return float(math.exp(intercept + np.dot(coefficients, features(xm, **kwargs))))
+
+    def relative(self, xm, **kwargs):
+        """predict(), or the prior cost in arbitrary units while untrained; good for ordering"""
+        seconds = self.predict(xm, **kwargs)
+        return seconds if seconds is not None else math.exp(np.dot(PRIOR, features(xm, **kwargs)))
+
+    def order(self, models, **kwargs):
+        """indices of models, longest predicted job first"""
+        costs = [self.relative(xm, **kwargs) for xm in models]
+        return sorted(range(len(models)), key=lambda n: -costs[n])
+
+    def schedule(self, models, workers, **kwargs):
+        """
+        longest processing time first packing of models onto workers: returns
+        (bins, loads), the model indices and predicted seconds of every worker
+        """
+        costs = [self.relative(xm, **kwargs) for xm in models]
+        heap = [(0., w) for w in range(workers)]
+        bins = [[] for _ in range(workers)]
+        loads = [0.]*workers
+        for n in sorted(range(len(models)), key=lambda n: -costs[n]):
+            load, w = heapq.heappop(heap)
+            bins[w].append(n)
+            loads[w] = load + costs[n]
+            heapq.heappush(heap, (loads[w], w))
+        return bins, loads
+
+    def eta(self, models, workers=None, **kwargs):
+        """predicted seconds for running models on workers slots longest first, None if untrained"""
+        if self.fit() is None:
+            return None
+        bins, loads = self.schedule(models, workers or os.cpu_count(), **kwargs)
+        return max(loads) if loads else 0.
@@ -0,0 +1,127 @@
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from .sweep import derive, run_job, unique
+from .spectrum import Spectrum, count_bands
+
+
+class Difference():
+    """
+    Outcome of xmimsim.paired() for one variant
+
+    Attributes
+    ------------
+     variant: the variant, as given
+     spectrum: xmimsim.Spectrum of the counts of the variant minus those of the base
+      model (mean over the replicates)
+     counts: {band: change of the counts} (mean over the replicates)
+     variance: {band: variance of the mean change}, None with a single replicate
+     spectrum_variance: the same per channel (array like spectrum.counts), or None
+     base_counts: {band: counts of the base model}
+     replicates: number of paired runs
+     results: the xmimsim.Result of every (base, variant) pair
+    """
+    def __init__(self, variant, spectrum, counts, variance, spectrum_variance, base_counts, results):
+        self.variant = variant
+        self.spectrum = spectrum
+        self.counts = counts
+        self.variance = variance
+        self.spectrum_variance = spectrum_variance
+        self.base_counts = base_counts
+        self.results = results
+        self.replicates = len(results)
+
+    def relative(self):
+        """{band: change relative to the counts of the base model}"""
+        return {band: change/self.base_counts[band] if self.base_counts[band] else float('nan')
+                for band, change in self.counts.items()}
+
+    def __repr__(self):
+        return '<xmimsim.Difference {!r}: {}>'.format(self.variant, self.counts)
+
+
+def paired(xm, variants, bands=None, replicates=1, seed_args=None, max_workers=None, set_threads=1, **kwargs):
+    """
+    Finite differences with common random numbers
+    
+    Usage
+    -------------
+    d = xmimsim.paired(xm, [{('layers',1,'thickness'): 0.0101}], bands={'k_a_Fe':[6.098,6.744]})
+    d[0].counts['k_a_Fe'] / 0.0001      # d(counts)/d(thickness)
+    
+    The base model and every variant are simulated with the same random
+    numbers, so the Monte Carlo noise mostly cancels in their difference and a
+    small change can be resolved with far fewer photons than with independent
+    runs. The streams only line up if everything that isn't part of the change
+    is the same, including the thread count, which is why set_threads is fixed
+    (default 1).
+    
+    Returns a list of xmimsim.Difference, one per variant.
+    
+    Seeds and variance
+    -------------
+    XMI-MSIM itself only offers one set of fixed seeds (--enable-default-seeds),
+    which is used by default: one pair per variant, and no variance estimate
+    (variance is None). For replicates > 1, seed_args(replicate) must return the
+    command line arguments that seed a run of XMI-MSIM with the seeds of
+    replicate (e.g. for a build or wrapper that takes explicit seeds). Every
+    replicate is then a separate pair, and the variance of the mean difference
+    is estimated from the spread of the pairs. The runs of each replicate get
+    their own files through a seed_tag.
+    
+    variants are as for xmimsim.sweep(); kwargs are handed to calculate().
+    """
+    if replicates > 1 and seed_args is None:
+        raise ValueError('XMI-MSIM has a single set of default seeds, replicates > 1 need seed_args')
+    if seed_args is None:
+        kwargs['default_seeds'] = True
+    jobs = [] # (replicate, position) with position 0 the base model, n+1 variant n
+    models = []
+    for r in range(replicates):
+        for n, variant in enumerate([None] + list(variants)):
+            # a set filename becomes filename_<replicate>_<0 for the base, n for variant n>
+            model = derive(xm, variant, '{}_{}'.format(r, n))
+            if seed_args is not None:
+                model.seed_tag = 'crn{}'.format(r)
+            jobs.append((r, n))
+            models.append(model)
+    kwargs['set_threads'] = set_threads
+    def run(xm):
+        r = jobs[models.index(xm)][0]
+        extra_args = list(kwargs.get('extra_args') or []) + (list(seed_args(r)) if seed_args else [])
+        return run_job(xm, bands, **dict(kwargs, extra_args=extra_args))
+    # a variant that doesn't change the model shares the run of the base
+    firsts, index = unique(models, **kwargs)
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+        done = list(pool.map(run, firsts))
+    results = [done[i] for i in index]
+    for result in results:
+        if not result.ok:
+            raise RuntimeError('a paired run failed: {!r}'.format(result.error)) from result.error
+    spectra = {job: result.spectrum for job, result in zip(jobs, results)}
+    counts = ({job: row for job, row in zip(jobs, count_bands([spectra[job] for job in jobs], bands))}
+              if bands else None)
+
+    differences = []
+    for n, variant in enumerate(variants, 1):
+        pairs = [(spectra[(r, 0)], spectra[(r, n)]) for r in range(replicates)]
+        if any(not np.array_equal(base.energy, other.energy) for base, other in pairs):
+            raise ValueError('variant {!r} changes the energy grid, the spectra can\'t be subtracted'.format(variant))
+        diffs = np.array([other.counts - base.counts for base, other in pairs])
+        unconvoluted = None
+        if all(base.unconvoluted is not None and other.unconvoluted is not None for base, other in pairs):
+            unconvoluted = np.mean([other.unconvoluted - base.unconvoluted for base, other in pairs], axis=0)
+        spectrum = Spectrum(pairs[0][0].energy, diffs.mean(axis=0), unconvoluted,
+                            {'difference': True, 'replicates': replicates})
+        spectrum_variance = diffs.var(axis=0, ddof=1)/replicates if replicates > 1 else None
+        band_counts = variance = base_counts = None
+        if bands:
+            deltas = np.array([counts[(r, n)] - counts[(r, 0)] for r in range(replicates)])
+            band_counts = dict(zip(bands, deltas.mean(axis=0).tolist()))
+            base_counts = dict(zip(bands, np.mean([counts[(r, 0)] for r in range(replicates)], axis=0).tolist()))
+            if replicates > 1:
+                variance = dict(zip(bands, (deltas.var(axis=0, ddof=1)/replicates).tolist()))
+        differences.append(Difference(variant, spectrum, band_counts, variance, spectrum_variance, base_counts,
+                                      [(results[jobs.index((r, 0))], results[jobs.index((r, n))])
+                                       for r in range(replicates)]))
+    return differences
@@ -0,0 +1,147 @@
+import os, re
+from concurrent.futures import ThreadPoolExecutor
+from .strings import s_header, s_layer, s_element
+from .func import get_elements
+from .xmimsim import model, render_layer
+from .canonical import memo
+
+
+_sentinel = '\x00{}\x00'
+_split = re.compile('\x00(\\d+)\x00')
+_LAYERS = ('layers', 'excitation_path', 'detector_path', 'crystal')
+
+
+def _elements(value):
+    """a layer composition in any form add_layer() takes it as elements=..."""
+    return get_elements((), {'elements': value})['elements']
+
+
+def _render_elements(elements):
+    return ''.join([s_element.format(atom,weight) for atom,weight in elements.items()])
+
+
+def compile_template(base, columns):
+    """
+    Renders base once with a placeholder for every column and splits the result
+    into [literal, column, literal, column, ..., literal]
+    """
+    xm = model.__new__(model)
+    xm.__dict__.update(base.__dict__)
+    xm.parameters = dict(base.parameters)
+    sections = {section: list(getattr(base, section)) for section in _LAYERS + ('sources',)}
+    xm.__dict__.update(sections)
+    fragments = {}
+    for n, column in enumerate(columns):
+        if not isinstance(column, tuple):
+            xm.parameters[column] = _sentinel.format(n)
+            continue
+        section, index, name = column
+        items = sections[section]
+        if name == 'elements':
+            fragments[(section, index)] = n
+        else:
+            items[index] = dict(items[index], **{name: _sentinel.format(n)})
+    # a varying composition can't go through render_layer(), those layers are
+    # rendered here with the placeholder in place of the elements
+    overrides = {}
+    for section in {section for section, index in fragments}:
+        overrides[section] = ''.join([
+            s_layer.format(**dict(layer, elements=_sentinel.format(fragments[(section, index)])))
+            if (section, index) in fragments else render_layer(layer)
+            for index, layer in enumerate(sections[section])])
+    text = xm.generate_base_xmsi(**overrides)
+    parts = _split.split(text)
+    return [int(part) if i % 2 else part for i, part in enumerate(parts)]
+
+
+def _variant(base, row):
+    """a bare model with the values of one row, enough for model.key()"""
+    xm = model.__new__(model)
+    xm.__dict__.update(base.__dict__)
+    xm.parameters = dict(base.parameters)
+    for column, value in row.items():
+        if not isinstance(column, tuple):
+            xm.parameters[column] = value
+            continue
+        section, index, name = column
+        items = list(getattr(xm, section))
+        items[index] = dict(items[index], **{name: value})
+        setattr(xm, section, items)
+    return xm
+
+
+def emit_xmsi(base, table, xmifolder='xmi', max_workers=None, **kwargs):
+    """
+    Writes the .xmsi files of many variants of a model at once
+    
+    Usage
+    -------------
+    paths = xmimsim.emit_xmsi(xm, {('layers',1,'thickness'): thicknesses,
+                                   ('layers',1,'elements'): [{'Fe':50,'As':50}, ...],
+                                   'n_photons_line': photons}, M_lines=False)
+    
+    Arguments
+    -------------
+    base: the xmimsim.model all rows are variants of
+    table: columnar table, {column: list of values}, all lists of the same length.
+     Columns are named as in xmimsim.apply_variant(): parameter names, or
+     (section, index, key) for layers and sources. An 'elements' column takes
+     the compositions in the form of add_layer(elements=...)
+    xmifolder: as in calculate()
+    max_workers: number of threads writing files (default: write from this thread)
+    **kwargs: the options of calculate(), which go into the file names
+    
+    Returns
+    -------------
+    the list of paths, one per row. Each file is named and filled exactly as
+    calculate() with the same options would write it, so calculating the
+    variants later picks them up. Rows that are the same model (same
+    model.key()) share one file, written from the first of them. The template
+    is compiled once and every file is then written with a single write call.
+    """
+    if kwargs.get('python_detector'):
+        raise ValueError('python_detector inputs depend on the source energies, use calculate() for those')
+    columns = list(table)
+    rows = len(table[columns[0]]) if columns else 1
+    for column in columns:
+        if len(table[column]) != rows:
+            raise ValueError('column {!r} has {} values instead of {}'.format(column, len(table[column]), rows))
+    template = compile_template(base, columns)
+    folder = os.path.join(os.getcwd(), xmifolder) if xmifolder is not None else os.getcwd()
+    os.makedirs(folder, exist_ok=True)
+    flags = base.command_flags(**kwargs)
+    # layers and sources no column touches stay the very same objects in every row
+    known = memo(base)
+    jobs = {}
+    paths = []
+    for r in range(rows):
+        row = {column: table[column][r] for column in columns}
+        for column in columns:
+            if isinstance(column, tuple) and column[2] == 'elements':
+                row[column] = _elements(row[column])
+        filename = os.path.join(folder, _variant(base, row).key(flags=flags, memo=known))
+        values = [_render_elements(row[column]) if isinstance(column, tuple) and column[2] == 'elements'
+                  else '{}'.format(row[column]) for column in columns]
+        if filename not in jobs:
+            jobs[filename] = s_header.format(filename) + ''.join(
+                [values[part] if i % 2 else part for i, part in enumerate(template)])
+        paths.append(filename + '.xmsi')
+    if max_workers:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            list(pool.map(_write, jobs.items(), chunksize=64))
+    else:
+        for job in jobs.items():
+            _write(job)
+    return paths
+
+
+def _write(job):
+    filename, text = job
+    if os.name == 'nt':
+        # calculate() writes in text mode
+        text = text.replace('\n', '\r\n')
+    fd = os.open(filename + '.xmsi', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        os.write(fd, text.encode())
+    finally:
+        os.close(fd)
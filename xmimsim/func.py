@@ -1,9 +1,58 @@
-import os
+import os, errno, shutil, tempfile
+from collections.abc import Mapping
 from math import sin, cos, pi
 
 
 XMIMSIM_BINARY = ("xmimsim-cli.exe" if os.name=='nt' else "xmimsim")
 
+def binary_not_found():
+    if os.name=='nt':
+        print('Error: XMI-MSIM simulation software could not be located by your machine.',
+        '',  
+        'If you installed XMI-MSIM (the software, not this python package),', 
+        'You must insert xmimsim-cli.exe into the enviroment variable path.', 
+        'Go to My computer (right click) -> properties -> advanced -> advanced',
+        '-> environment variables... -> Path and edit path by adding xmimsim-cli.exe',
+        'directory into path (probably the path is something like',
+        '"C:/Program Files/XMI-MSIM 64-bit/Bin/xmimsim-cli.exe" ',
+        'but you will have to use "browse" to look for it at the exact location.',
+        '',
+        'Otherwise it will not be able to run on windows.',sep='\n')
+    else:
+         print('Error:XMI-MSIM command not found (try running xmimsim --help from the command line)')
+
+def move_file(source, destination):
+    """os.replace() that also works across filesystems (e.g. from a tmpfs), still atomic at the destination"""
+    try:
+        os.replace(source, destination)
+    except OSError as error:
+        if error.errno != errno.EXDEV: raise
+        handle, partial = tempfile.mkstemp(dir=os.path.dirname(destination), suffix='.part')
+        os.close(handle)
+        try:
+            shutil.copyfile(source, partial)
+            os.replace(partial, destination)
+        except BaseException:
+            os.remove(partial)
+            raise
+        os.remove(source)
+    return destination
+
+def scratch_folder(scratch):
+    """the folder of calculate(scratch=...): True picks a RAM backed one if there is one"""
+    if scratch is True:
+        scratch = '/dev/shm' if os.access('/dev/shm', os.W_OK) else tempfile.gettempdir()
+    os.makedirs(scratch, exist_ok=True)
+    return scratch
+
+def freeze(item):
+    """hashable copy of a layer or source dictionary, keeping the element order"""
+    if isinstance(item, Mapping):
+        return tuple((k, freeze(v)) for k, v in item.items())
+    if isinstance(item, (list, tuple)):
+        return tuple(freeze(v) for v in item)
+    return item
+
 def rtp(input_list):
     r,theta,phi = input_list
     theta = theta*pi/180
@@ -0,0 +1,68 @@
+import math
+import numpy as np
+
+
+def dead_time_factor(total, live_time, pulse_width):
+    """fraction of the counts a non-paralyzable detector records (dead time = pulse_width)"""
+    rate = total/float(live_time)
+    return 1/(1 + rate*float(pulse_width))
+
+
+def pile_up(energy, counts, live_time, pulse_width):
+    """
+    First order pile-up of an expected spectrum
+    
+    A pulse piles up with the next one with probability p = 1-exp(-rate*pulse_width).
+    Those events are taken out of the spectrum and come back in pairs at the sum
+    of their energies, distributed as the spectrum convoluted with itself.
+    Assumes a linear energy calibration, as XMI-MSIM spectra have.
+    """
+    counts = np.asarray(counts, dtype=float)
+    total = counts.sum()
+    if total <= 0:
+        return counts.copy()
+    p = 1 - math.exp(-total/float(live_time)*float(pulse_width))
+    gain = energy[1] - energy[0]
+    shift = int(round(energy[0]/gain))
+    # pairs of channels i, j end up in channel i+j+shift
+    summed = np.convolve(counts/total, counts/total)
+    piled = np.zeros_like(counts)
+    start = max(0, shift)
+    stop = min(len(counts), len(summed)+shift)
+    if stop > start:
+        piled[start:stop] = summed[start-shift:stop-shift]
+    return (1-p)*counts + p*total/2*piled
+
+
+def realizations(spectrum, n, live_time=None, pulse_width=None, pile_up_model=False, dead_time=False,
+                 order=-1, convoluted=True, seed=None):
+    """
+    Draws n noisy versions of one noise free spectrum at once
+    
+    Usage
+    -------------
+    noisy = xmimsim.realizations(xm.get_spectrum(), 10000, seed=1)
+    noisy.shape == (10000, channels)
+    
+    Arguments
+    -------------
+    spectrum: the xmimsim.Spectrum to use as expected counts per channel
+    n: number of realizations
+    live_time, pulse_width: detector_live_time and detector_pulse_width, only
+     needed for pile_up_model and dead_time
+    pile_up_model: add first order pile-up to the expected spectrum (see pile_up())
+    dead_time: scale the counts down for a non-paralyzable dead time of pulse_width
+    order, convoluted: which of the spectra in spectrum to use
+    seed: seed or numpy Generator, for reproducible realizations
+    
+    Returns
+    -------------
+    integer array of shape (n, channels) with Poisson distributed counts
+    """
+    expected = np.asarray((spectrum.counts if convoluted else spectrum.unconvoluted)[order], dtype=float)
+    if pile_up_model:
+        expected = pile_up(spectrum.energy, expected, live_time, pulse_width)
+    if dead_time:
+        expected = expected*dead_time_factor(expected.sum(), live_time, pulse_width)
+    rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+    return rng.poisson(np.clip(expected, 0, None), size=(n, len(expected)))
@@ -0,0 +1,152 @@
+import contextlib, hashlib, json, os, tempfile, threading
+from .canonical import layer, number
+
+try:
+    import fcntl
+except ImportError: # windows: only threads of this process are kept apart
+    fcntl = None
+
+# what the solid angle grid and the escape ratios of XMI-MSIM are computed from
+GEOMETRY = ('d_sample_source', 'n_sample_orientation_x', 'n_sample_orientation_y', 'n_sample_orientation_z',
+            'p_detector_window_x', 'p_detector_window_y', 'p_detector_window_z',
+            'n_detector_orientation_x', 'n_detector_orientation_y', 'n_detector_orientation_z',
+            'area_detector', 'collimator_height', 'collimator_diameter', 'd_source_slit',
+            'slit_size_x', 'slit_size_y', 'reference_layer')
+
+
+def _key(data):
+    return hashlib.sha224(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+class PrecomputedData():
+    """
+    Shares the solid angle grids and detector escape ratios of XMI-MSIM between runs
+    
+    Usage
+    -------------
+    data = xmimsim.PrecomputedData('/scratch/xmi-data')
+    xmimsim.sweep(xm, variants, data=data)      # or xm.calculate(data=data)
+    data.warm(models)                            # computes them up front, sweep() does this
+    
+    XMI-MSIM computes both tables on its first run for a geometry (solid angles,
+    with variance reduction) or detector crystal (escape ratios, with escape
+    peaks) and keeps them in one HDF5 file per user, which concurrent runs
+    recompute or fight over. With data, every configuration gets its own pair
+    of files in root, passed with --with-solid-angles-data and
+    --with-escape-ratios-data. The first run of a configuration computes them
+    while holding a lock (a lock file, so other processes on the same
+    filesystem wait as well); runs of the same configuration wait for it and
+    from then on only read the files. That first run holds the lock for its
+    whole simulation, so warm() the models before running them in parallel
+    with calculate(); sweep() and iter_sweep() warm them with a one photon run.
+    
+    A configuration is keyed by the geometry and sample layers (solid angles)
+    and by the detector type and crystal (escape ratios).
+    """
+    def __init__(self, root=None):
+        if root is None:
+            root = os.path.join(tempfile.gettempdir(), 'xmimsim-data')
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def files(self, xm, variance_reduction=True, escape_peaks=True, **kwargs):
+        """{option: path} of the data files the run of xm with these calculate() options uses"""
+        p = xm.parameters
+        files = {}
+        if variance_reduction:
+            data = {'geometry': {k: number(p.get(k, 0)) for k in GEOMETRY},
+                    'layers': [layer(l) for l in xm.layers]}
+            files['--with-solid-angles-data'] = os.path.join(self.root, 'solid_angles_{}.h5'.format(_key(data)))
+        if escape_peaks:
+            data = {'detector_type': p.get('detector_type'), 'crystal': [layer(l) for l in xm.crystal]}
+            files['--with-escape-ratios-data'] = os.path.join(self.root, 'escape_ratios_{}.h5'.format(_key(data)))
+        return files
+
+    def options(self, xm, **kwargs):
+        """the command line options for the data files, see files()"""
+        return ['{}={}'.format(option, path) for option, path in self.files(xm, **kwargs).items()]
+
+    def ready(self, path):
+        return os.path.isfile(path + '.ready')
+
+    def acquire(self, paths):
+        """
+        Waits until every one of paths is either computed or locked by this
+        caller, who then has to compute it. Returns the locked ones, to be passed
+        to release()
+        """
+        held = []
+        for path in sorted(paths):
+            if self.ready(path):
+                continue
+            lock = self._file_lock(path)
+            if self.ready(path): # computed while we waited
+                self._unlock(path, lock)
+            else:
+                held.append((path, lock))
+        return held
+
+    def release(self, held, ok=True):
+        """marks the held files computed if ok and unlocks them"""
+        for path, lock in held:
+            if ok and os.path.isfile(path):
+                open(path + '.ready', 'w').close()
+            self._unlock(path, lock)
+
+    @contextlib.contextmanager
+    def computing(self, xm, **kwargs):
+        """holds the locks of the missing data files of xm during a run of it"""
+        held = self.acquire(self.files(xm, **kwargs).values())
+        ok = False
+        try:
+            yield
+            ok = not getattr(xm, 'returncode', 0)
+        finally:
+            self.release(held, ok)
+
+    def warm(self, models, max_workers=None, **kwargs):
+        """
+        Computes the data files of every distinct configuration among models with
+        a cheap run (one photon per line, in a temporary folder). kwargs are the
+        options of calculate() the models will be run with
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from .sweep import derive
+        firsts = {}
+        for xm in models:
+            files = self.files(xm, **kwargs)
+            if files and not all(self.ready(path) for path in files.values()):
+                firsts.setdefault(tuple(sorted(files.values())), xm)
+        def run(xm):
+            xm = derive(xm)
+            xm.set_parameters(n_photons_interval=1, n_photons_line=1)
+            with tempfile.TemporaryDirectory(dir=self.root) as folder:
+                xm.calculate(**dict(kwargs, xmifolder=folder, data=self, save_xmsi=False, save_xmso=True,
+                                    export=None, cache=None, force_overwrite=True, verbose=False))
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            list(pool.map(run, firsts.values()))
+        return len(firsts)
+
+    def _file_lock(self, path):
+        with self._lock:
+            thread_lock = self._locks.setdefault(path, threading.Lock())
+        thread_lock.acquire()
+        if fcntl is None:
+            return None
+        handle = open(path + '.lock', 'w')
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    def _unlock(self, path, handle):
+        if handle is not None:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            handle.close()
+        self._locks[path].release()
+
+    def __getstate__(self):
+        return {'root': self.root}
+
+    def __setstate__(self, state):
+        self.__init__(state['root'])
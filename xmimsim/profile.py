@@ -0,0 +1,144 @@
+import contextlib, os, subprocess, threading, time, warnings
+
+_hooks = []
+
+
+def add_hook(hook):
+    """
+    calls hook(event) for every timed phase of every calculation from now on.
+    
+    An event is a dictionary with
+     phase: 'render' (the input and its key), 'write' (the .xmsi), 'simulate'
+      (XMI-MSIM from start to exit, including its own startup and export
+      conversion, which can't be told apart from the outside), 'collect' (cleanup
+      and the cache), 'parse' (reading the spectrum) or 'convolve' (python_detector)
+     start, seconds: wall clock start (time.time()) and duration
+     file: the filelocation of the model (None before it is named)
+     for 'simulate' also returncode, cpu_seconds (user+system of the XMI-MSIM
+      process, None where the OS doesn't report it) and photons_per_second
+      (n_photons_line for every source, per wall second)
+    
+    Hooks run in the thread of the calculation and must be thread safe. An
+    exception raised by a hook is turned into a warning, it never stops the
+    calculation.
+    """
+    _hooks.append(hook)
+    return hook
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+@contextlib.contextmanager
+def timed(phase, xm):
+    """times the block and emits an event for phase; add fields to the yielded dict"""
+    if not _hooks:
+        yield {}
+        return
+    event = {'phase': phase, 'start': time.time()}
+    begin = time.perf_counter()
+    try:
+        yield event
+    finally:
+        #the bookkeeping must not break the calculation it watches
+        try:
+            event['seconds'] = time.perf_counter() - begin
+            event['file'] = getattr(xm, 'filelocation', None)
+            if phase == 'simulate':
+                event['photons_per_second'] = photons(xm)/event['seconds'] if event['seconds'] else None
+        except Exception as error:
+            warnings.warn('timing of {} failed: {!r}'.format(phase, error))
+        for hook in list(_hooks):
+            try:
+                hook(event)
+            except Exception as error:
+                warnings.warn('profiling hook {!r} failed: {!r}'.format(hook, error))
+
+
+def photons(xm):
+    """the number of photons XMI-MSIM traces for the model"""
+    return float(xm.parameters.get('n_photons_line', 0)) * max(len(xm.sources), 1)
+
+
+class Popen(subprocess.Popen):
+    """subprocess.Popen which keeps the resource usage of the child when it is reaped (POSIX)"""
+    rusage = None
+
+    if hasattr(os, 'wait4'):
+        def _try_wait(self, wait_flags):
+            try:
+                pid, sts, rusage = os.wait4(self.pid, wait_flags)
+            except ChildProcessError:
+                return (self.pid, 0)
+            if pid:
+                self.rusage = rusage
+            return (pid, sts)
+
+    @property
+    def cpu_seconds(self):
+        return None if self.rusage is None else self.rusage.ru_utime + self.rusage.ru_stime
+
+
+class Profile():
+    """
+    Collects the timing events of calculations and summarizes them per phase
+    
+    Usage
+    -------------
+    with xmimsim.profiling() as profile:
+        xmimsim.sweep(xm, variants)
+    print(profile)              # table of the phases, slowest first
+    profile.summary()           # the same as a dictionary
+    profile.events              # every single event
+    
+    A Profile can also be passed to xmimsim.add_hook() directly.
+    """
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            self.events.append(event)
+
+    def summary(self):
+        """{phase: {'count', 'seconds', 'mean', 'max', 'share'}}, plus cpu_seconds
+        and photons_per_second for 'simulate'"""
+        with self._lock:
+            events = list(self.events)
+        phases = {}
+        for event in events:
+            phases.setdefault(event['phase'], []).append(event)
+        total = sum(event['seconds'] for event in events) or 1
+        summary = {}
+        for phase, group in phases.items():
+            seconds = [event['seconds'] for event in group]
+            summary[phase] = {'count': len(group), 'seconds': sum(seconds),
+                              'mean': sum(seconds)/len(group), 'max': max(seconds),
+                              'share': sum(seconds)/total}
+            if phase == 'simulate':
+                cpu = [event['cpu_seconds'] for event in group if event.get('cpu_seconds') is not None]
+                rates = [event['photons_per_second'] for event in group if event.get('photons_per_second')]
+                summary[phase]['cpu_seconds'] = sum(cpu) if cpu else None
+                summary[phase]['photons_per_second'] = sum(rates)/len(rates) if rates else None
+        return dict(sorted(summary.items(), key=lambda item: -item[1]['seconds']))
+
+    def __str__(self):
+        lines = ['{:<10}{:>7}{:>12}{:>10}{:>10}{:>8}'.format('phase', 'count', 'seconds', 'mean', 'max', 'share')]
+        for phase, s in self.summary().items():
+            lines.append('{:<10}{:>7}{:>12.3f}{:>10.3f}{:>10.3f}{:>7.1%}'.format(
+                phase, s['count'], s['seconds'], s['mean'], s['max'], s['share']))
+            if s.get('cpu_seconds') is not None:
+                lines.append('{:<10}cpu {:.3f} s, {:.4g} photons/s'.format('', s['cpu_seconds'], s['photons_per_second'] or 0))
+        return '\n'.join(lines)
+
+
+@contextlib.contextmanager
+def profiling():
+    """collects the events of all calculations in the block into a xmimsim.Profile"""
+    profile = add_hook(Profile())
+    try:
+        yield profile
+    finally:
+        remove_hook(profile)
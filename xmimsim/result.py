@@ -0,0 +1,36 @@
+class Result():
+    """
+    Outcome of a single simulation run through one of the batch helpers
+    (e.g. xmimsim.sweep())
+
+    Attributes
+    ------------
+     model: the xmimsim.model that was calculated
+     spectrum: the xmimsim.Spectrum as returned by model.get_spectrum() (None on failure)
+     counts: the band counts as returned by model.count_photons(**bands), if
+      any bands were requested
+     error: the exception raised while running the job, None if it succeeded
+     elapsed: wall time of the job in seconds
+     index: position of the job in its batch, for the results of xmimsim.iter_sweep()
+      and xmimsim.iter_many_async(), which come in the order they finish
+
+    A Result unpacks as (model, spectrum, counts):
+    for xm, spectrum, counts in xmimsim.iter_sweep(xm, variants, bands=bands): ...
+    """
+    def __init__(self, model, spectrum=None, counts=None, error=None, elapsed=None):
+        self.model = model
+        self.spectrum = spectrum
+        self.counts = counts
+        self.error = error
+        self.elapsed = elapsed
+
+    def __iter__(self):
+        return iter((self.model, self.spectrum, self.counts))
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        state = 'ok' if self.ok else 'failed: {!r}'.format(self.error)
+        return '<xmimsim.Result {} ({})>'.format(getattr(self.model, 'filelocation', '?'), state)
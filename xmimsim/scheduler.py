@@ -0,0 +1,114 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .sweep import run_job
+
+
+class ThreadBudget():
+    """
+    Shares a fixed number of cores between concurrently running simulations
+    
+    Every simulation is started with --set-threads, so that
+    (simulations at once) x (threads per simulation) never exceeds the budget.
+    Which split is fastest depends on the machine and the models (XMI-MSIM does
+    not scale linearly with threads), so the budget measures it: every split is
+    tried for waves x (simulations at once) jobs and after that the split with
+    the highest measured throughput is used, while its throughput keeps being
+    updated. A job is started as soon as enough cores are free for the split
+    chosen for it, so no core waits for the slowest job of a round, and its run
+    time counts for the split it ran with.
+
+    The throughput of a split is (simulations at once) / (mean run time of its
+    jobs). Jobs of different sizes would favour the split that happened to get
+    the small ones, so with a cost model (sweep(..., cost=...)) every job is
+    weighted by its predicted cost, and without one the comparison is only fair
+    for jobs of about the same size (e.g. varying thicknesses or compositions,
+    not n_photons_line).
+    
+    Usage
+    -------------
+    budget = xmimsim.ThreadBudget(cores=64)
+    results = xmimsim.sweep(xm, variants, budget=budget)
+    budget.best, budget.rates()
+    
+    Arguments
+    -------------
+    cores: number of cores to share (default os.cpu_count())
+    splits: list of (simulations, threads) pairs to choose from. The default
+     uses every power of two number of threads up to cores (plus cores itself)
+    waves: number of jobs per simulation slot each split is tried for. More
+     measure better but spend longer on bad splits
+    """
+    def __init__(self, cores=None, splits=None, waves=2):
+        self.cores = cores or os.cpu_count()
+        if splits is None:
+            threads, splits = 1, []
+            while threads < self.cores:
+                splits.append((self.cores//threads, threads))
+                threads *= 2
+            splits.append((1, self.cores))
+        for jobs, threads in splits:
+            if jobs*threads > self.cores:
+                raise ValueError('split {}x{} exceeds the budget of {} cores'.format(jobs, threads, self.cores))
+        self.splits = list(splits)
+        self.waves = waves
+        self.measured = {}
+        self.started = {}
+
+    def record(self, split, jobs, seconds):
+        """
+        adds to the measurements of split: jobs simulations (weighted by their
+        cost) took seconds of wall time
+        """
+        total_jobs, total_seconds = self.measured.get(split, (0, 0.))
+        self.measured[split] = (total_jobs+jobs, total_seconds+seconds)
+
+    def rates(self):
+        """measured simulations per second for every split tried so far"""
+        return {split: jobs/seconds for split, (jobs, seconds) in self.measured.items() if seconds > 0}
+
+    @property
+    def best(self):
+        rates = self.rates()
+        return max(rates, key=rates.get) if rates else None
+
+    def choose(self):
+        """the next split to use: untried splits first, then the fastest one"""
+        for split in self.splits:
+            if self.started.get(split, 0) < split[0]*self.waves:
+                return split
+        return self.best or self.splits[0]
+
+    def run(self, models, bands=None, cost=None, **kwargs):
+        """
+        Calculates all models within the budget and returns their xmimsim.Result
+        in order. kwargs are handed to model.calculate(), except set_threads which
+        is chosen by the budget. cost: optional xmimsim.CostModel to weight the
+        measurements by the predicted size of the jobs
+        """
+        kwargs.pop('set_threads', None)
+        results = [None]*len(models)
+        queue = list(enumerate(models))
+        running = {}
+        free = self.cores
+        with ThreadPoolExecutor(max_workers=self.cores) as pool:
+            while queue or running:
+                #fill the free cores, as long as the split chosen next fits
+                while queue:
+                    split = self.choose()
+                    jobs, threads = split
+                    if threads > free or sum(1 for job in running.values() if job[2] == split) >= jobs:
+                        break
+                    n, xm = queue.pop(0)
+                    self.started[split] = self.started.get(split, 0) + 1
+                    free -= threads
+                    running[pool.submit(run_job, xm, bands, set_threads=threads, **kwargs)] = (n, xm, split)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    n, xm, split = running.pop(future)
+                    free += split[1]
+                    results[n] = future.result()
+                    # failed runs and cached results (XMI-MSIM was never started) would skew the rate
+                    if getattr(xm, 'returncode', None) == 0 and results[n].elapsed:
+                        size = cost.relative(xm, **kwargs) if cost is not None else 1.
+                        self.record(split, split[0]*size, results[n].elapsed)
+        return results
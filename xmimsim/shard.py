@@ -0,0 +1,195 @@
+import math, os, time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from .result import Result
+from .sweep import derive
+from .spectrum import Spectrum
+
+
+def split_photons(n, shards):
+    """splits n photons into shards integers that differ by at most one"""
+    n = int(float(n))
+    return [n//shards + (1 if i < n % shards else 0) for i in range(shards)]
+
+
+def interval_photons(xm, n_photons_line):
+    """
+    n_photons_interval for a part of xm with n_photons_line photons: in the same
+    proportion to the line photons as in xm, but at least 1 (0 is no valid input)
+    """
+    ratio = float(xm.parameters['n_photons_interval'])/float(xm.parameters['n_photons_line'])
+    return max(1, int(round(float(n_photons_line)*ratio)))
+
+
+def shards(xm, n):
+    """
+    Splits the photon budget of a model into n independent models (shards)
+    
+    Every shard gets about 1/n of n_photons_line and n_photons_interval (at
+    least 1, see interval_photons()) and a seed_tag, so each shard writes its own files and, since XMI-MSIM draws new
+    seeds for every run, simulates an independent part of the photons. The
+    shards can be calculated anywhere (they pickle) and combined again with
+    xmimsim.merge_shards() or xmimsim.merge_xmso().
+    
+    The shards have to be calculated without default_seeds, otherwise they
+    would all simulate the same photons.
+    """
+    lines = split_photons(xm.parameters['n_photons_line'], n)
+    models = []
+    for i in range(n):
+        shard = derive(xm, {'n_photons_line': lines[i], 'n_photons_interval': interval_photons(xm, lines[i])})
+        shard.seed_tag = 'shard{}of{}'.format(i, n)
+        if 'filename' in shard.__dict__:
+            shard.filename = '{}_{}'.format(shard.filename, shard.seed_tag)
+        models.append(shard)
+    return models
+
+
+def merge_spectra(spectra, weights):
+    """
+    Weighted mean of xmimsim.Spectrum objects on the same energy grid
+    
+    XMI-MSIM normalizes its spectra to the source intensity and live time, not to
+    the number of simulated photons, so the spectrum of one big run is estimated
+    by the mean of the shards, weighted by the photons each shard simulated.
+    """
+    weights = np.asarray(weights, dtype=float)/np.sum(weights)
+    counts = np.tensordot(weights, [spectrum.counts for spectrum in spectra], axes=1)
+    unconvoluted = None
+    if all(spectrum.unconvoluted is not None for spectrum in spectra):
+        unconvoluted = np.tensordot(weights, [spectrum.unconvoluted for spectrum in spectra], axes=1)
+    return Spectrum(spectra[0].energy, counts, unconvoluted, {'shards': len(spectra)})
+
+
+def merge_xmso(files, weights=None):
+    """
+    Merges the .xmso files of shards into one xmimsim.Spectrum holding the
+    convoluted and unconvoluted spectra of every interaction order.
+    weights default to equal shards.
+    """
+    return merge_spectra([Spectrum.from_xmso(file) for file in files], weights or [1]*len(files))
+
+
+def merge_shards(models):
+    """merge_xmso() for calculated shard models, weighted by their n_photons_line"""
+    return merge_xmso([xm.filelocation + '.xmso' for xm in models],
+                      [float(xm.parameters['n_photons_line']) for xm in models])
+
+
+def run_shards(models, max_workers=None, **kwargs):
+    """calculates shard models in parallel, keeping their .xmso for merging"""
+    kwargs.update(save_xmso=True, export=None)
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+        for future in [pool.submit(shard.calculate, **kwargs) for shard in models]:
+            future.result()
+    for shard in models:
+        if getattr(shard, 'returncode', 0):
+            raise RuntimeError('XMI-MSIM exited with code {} for {}'.format(shard.returncode, shard.filelocation))
+
+
+def remove_shards(models):
+    for shard in models:
+        for extension in ('.xmso', '.xmsi'):
+            if os.path.isfile(shard.filelocation + extension):
+                os.remove(shard.filelocation + extension)
+
+
+def calculate_sharded(xm, n, max_workers=None, bands=None, keep_shards=False, **kwargs):
+    """
+    Calculates one model as n shards in parallel and merges the spectra
+    
+    Usage
+    -------------
+    result = xmimsim.calculate_sharded(xm, 16, max_workers=16, set_threads=4)
+    result.spectrum.counts, result.spectrum.unconvoluted
+    
+    The merged spectrum (convoluted and unconvoluted, all interaction orders)
+    is also set as xm.spectrum, so xm.count_photons() works as after a normal
+    calculation. The shard files are removed unless
+    keep_shards is True. kwargs are handed to model.calculate() of every shard.
+    """
+    if kwargs.get('default_seeds'):
+        raise ValueError('shards calculated with default_seeds would all be identical')
+    start = time.time()
+    models = shards(xm, n)
+    run_shards(models, max_workers, **kwargs)
+    xm.spectrum = merge_shards(models)
+    if not keep_shards:
+        remove_shards(models)
+    counts = xm.count_photons(**bands) if bands else None
+    return Result(xm, xm.spectrum, counts, elapsed=time.time()-start)
+
+
+def calculate_adaptive(xm, bands, rtol=0.01, increment=None, max_photons=None, max_workers=None,
+                       keep_shards=False, **kwargs):
+    """
+    Calculates a model with only as many photons as needed for the given bands
+    
+    The model is simulated in increments of increment photons (independent
+    shards, see xmimsim.shards()), max_workers increments at a time. After
+    every round the relative standard error of every band in bands is estimated
+    from the spread between the increments, and it stops as soon as all of them
+    are at or below rtol, or max_photons have been simulated.
+    
+    Usage
+    -------------
+    result = xmimsim.calculate_adaptive(xm, {'k_a_Fe':[6.098,6.744],'k_a_As':[10.196,10.890]}, rtol=0.005)
+    result.counts, result.photons, result.uncertainty
+    
+    Arguments
+    -------------
+    bands: dictionary in the format of count_photons(**bands)
+    rtol: wanted relative standard error of every band
+    increment: photons per increment (default n_photons_line/100)
+    max_photons: upper limit of photons to simulate (default n_photons_line, so
+     it never takes longer than calculating the model itself)
+    
+    Returns
+    -------------
+    a xmimsim.Result with the merged spectrum and band counts, where
+    result.photons is the number of line photons actually used and
+    result.uncertainty the estimated relative standard error per band.
+    n_photons_interval is scaled along with the line photons.
+    """
+    if kwargs.get('default_seeds'):
+        raise ValueError('increments calculated with default_seeds would all be identical')
+    start = time.time()
+    n_photons_line = float(xm.parameters['n_photons_line'])
+    max_photons = max_photons or n_photons_line
+    increment = int(increment or max(1, n_photons_line//100))
+    max_workers = max_workers or os.cpu_count()
+    models, values = [], {name: [] for name in bands}
+    while True:
+        # at least two increments are needed to estimate the spread
+        batch = max(2 - len(models), min(max_workers, int((max_photons - increment*len(models))//increment)))
+        if batch <= 0:
+            break
+        new = []
+        for i in range(len(models), len(models)+batch):
+            shard = derive(xm, {'n_photons_line': increment,
+                                'n_photons_interval': interval_photons(xm, increment)})
+            shard.seed_tag = 'increment{}of{}'.format(i, increment)
+            if 'filename' in shard.__dict__:
+                shard.filename = '{}_{}'.format(shard.filename, shard.seed_tag)
+            new.append(shard)
+        run_shards(new, max_workers, **kwargs)
+        for shard in new:
+            spectrum = Spectrum.from_xmso(shard.filelocation + '.xmso')
+            for name, span in bands.items():
+                values[name].append(spectrum.photons(*span))
+        models += new
+        uncertainty = {}
+        for name, counts in values.items():
+            k = len(counts)
+            mean = sum(counts)/k
+            variance = sum((c-mean)**2 for c in counts)/(k-1)
+            uncertainty[name] = math.sqrt(variance/k)/abs(mean) if mean else float('inf')
+        if all(u <= rtol for u in uncertainty.values()):
+            break
+    xm.spectrum = merge_shards(models)
+    if not keep_shards:
+        remove_shards(models)
+    result = Result(xm, xm.spectrum, xm.count_photons(**bands), elapsed=time.time()-start)
+    result.photons = increment*len(models)
+    result.uncertainty = uncertainty
+    return result
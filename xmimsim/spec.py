@@ -0,0 +1,163 @@
+from collections.abc import Mapping
+from .func import get_elements, rtp
+from .xmimsim import model
+
+
+SECTIONS = ('layers', 'excitation_path', 'detector_path', 'crystal', 'sources')
+
+
+class FrozenDict(Mapping):
+    """read-only, hashable dictionary; set() returns an updated copy"""
+    __slots__ = ('_data', '_hash')
+
+    def __init__(self, *args, **kwargs):
+        object.__setattr__(self, '_data', dict(*args, **kwargs))
+        object.__setattr__(self, '_hash', None)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __hash__(self):
+        if self._hash is None:
+            object.__setattr__(self, '_hash', hash(frozenset(self._data.items())))
+        return self._hash
+
+    def __setattr__(self, name, value):
+        raise AttributeError('FrozenDict is read-only')
+
+    def __repr__(self):
+        return 'FrozenDict({!r})'.format(self._data)
+
+    def __reduce__(self):
+        return (FrozenDict, (self._data,))
+
+    def set(self, **changes):
+        return FrozenDict(self._data, **changes)
+
+
+def _freeze(value):
+    if isinstance(value, Mapping):
+        return FrozenDict({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _thaw(value):
+    if isinstance(value, Mapping):
+        return {k: _thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(v) for v in value]
+    return value
+
+
+class ModelSpec():
+    """
+    Immutable, hashable description of a model, for sharing between threads
+    
+    Every with_...() method returns a new spec that shares everything it didn't
+    change with the old one, so deriving a variant costs as much as the change.
+    Equal specs hash equal and can be used as dictionary keys.
+    
+    Usage
+    -------------
+    spec = xmimsim.ModelSpec.from_model(xm)         # or xm.spec()
+    thicker = spec.with_layer(1, thickness=0.02)
+    other_beam = spec.with_source(0, energy=17.4)
+    thicker.to_model().calculate()                  # back to the fluent model API
+    thicker.key() == thicker.to_model().key()
+    
+    The layers and sources are FrozenDicts with the same keys as the
+    dictionaries of xmimsim.model, the elements of a layer included.
+    """
+    __slots__ = ('parameters',) + SECTIONS + ('_hash',)
+
+    def __init__(self, parameters, layers=(), excitation_path=(), detector_path=(), crystal=(), sources=()):
+        object.__setattr__(self, 'parameters', _freeze(parameters))
+        for section, items in zip(SECTIONS, (layers, excitation_path, detector_path, crystal, sources)):
+            object.__setattr__(self, section, tuple(_freeze(item) for item in items))
+        object.__setattr__(self, '_hash', None)
+
+    @classmethod
+    def from_model(cls, xm):
+        return cls(xm.parameters, *[getattr(xm, section) for section in SECTIONS])
+
+    def to_model(self):
+        """a new, independent xmimsim.model with the contents of this spec"""
+        xm = model()
+        xm.parameters = _thaw(self.parameters)
+        for section in SECTIONS:
+            setattr(xm, section, [_thaw(item) for item in getattr(self, section)])
+        return xm
+
+    def _replace(self, **changes):
+        spec = object.__new__(ModelSpec)
+        for name in ('parameters',) + SECTIONS:
+            object.__setattr__(spec, name, changes.get(name, getattr(self, name)))
+        object.__setattr__(spec, '_hash', None)
+        return spec
+
+    def __setattr__(self, name, value):
+        raise AttributeError('ModelSpec is immutable, use the with_...() methods')
+
+    def __eq__(self, other):
+        return isinstance(other, ModelSpec) and all(
+            getattr(self, name) == getattr(other, name) for name in ('parameters',) + SECTIONS)
+
+    def __hash__(self):
+        if self._hash is None:
+            object.__setattr__(self, '_hash', hash(tuple(getattr(self, name) for name in ('parameters',) + SECTIONS)))
+        return self._hash
+
+    def __repr__(self):
+        return '<xmimsim.ModelSpec {} layers, {} sources>'.format(len(self.layers), len(self.sources))
+
+    def __reduce__(self):
+        return (ModelSpec, (self.parameters,) + tuple(getattr(self, s) for s in SECTIONS))
+
+    def with_parameters(self, **changes):
+        """set_parameters() for specs"""
+        return self._replace(parameters=self.parameters.set(**_freeze(changes)))
+
+    def with_item(self, section, index, **changes):
+        """changes keys of one layer or source, e.g. with_item('crystal', 0, thickness=0.5)"""
+        items = list(getattr(self, section))
+        items[index] = items[index].set(**_freeze(changes))
+        return self._replace(**{section: tuple(items)})
+
+    def with_layer(self, index, **changes):
+        """
+        changes a sample layer. The composition can be given in any of the forms
+        of add_layer(), e.g. with_layer(1, symbols=['Fe','As'], masses=[60,40])
+        """
+        if any(k in changes for k in ('elements', 'masses', 'symbols', 'atomic_numbers')):
+            changes = get_elements((), changes)
+        return self.with_item('layers', index, **changes)
+
+    def with_source(self, index, **changes):
+        return self.with_item('sources', index, **changes)
+
+    def with_added(self, section, *args, **kwargs):
+        """add_layer() and friends for specs, e.g. with_added('detector_path', density=...)"""
+        item = kwargs if section == 'sources' else get_elements(args, kwargs)
+        return self._replace(**{section: getattr(self, section) + (_freeze(item),)})
+
+    def with_orientation(self, name, **kwargs):
+        """
+        sample_orientation() and friends for specs: name is 'n_sample_orientation',
+        'n_detector_orientation' or 'p_detector_window', kwargs xyz=[...] or rthetaphi=[...]
+        """
+        xyz = rtp(kwargs['rthetaphi']) if 'rthetaphi' in kwargs else kwargs['xyz']
+        return self.with_parameters(**{name + '_' + d: v for d, v in zip('xyz', xyz)})
+
+    def key(self, **kwargs):
+        """model.key() of this spec"""
+        xm = object.__new__(model)
+        xm.__dict__.update({name: getattr(self, name) for name in ('parameters',) + SECTIONS})
+        return model.key(xm, **kwargs)
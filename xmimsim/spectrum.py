@@ -0,0 +1,168 @@
+import numpy as np
+from .xmso import read_xmso
+
+
+class Spectrum():
+    """
+    A simulated spectrum held in contiguous numpy arrays
+    
+    Attributes
+    ------------
+     energy: channel energies in keV, shape (channels,)
+     counts: convoluted counts, shape (interactions, channels); counts[-1] holds
+      the counts up to the highest interaction order
+     unconvoluted: same for the spectrum without detector convolution, or None
+      if it wasn't available (e.g. read from a csv export)
+     metadata: dictionary with whatever was known about the run
+    
+    For compatibility it also behaves like the list returned by get_spectrum()
+    before: len(spectrum), spectrum[n] and iterating give [energy, counts, ...] rows.
+    
+    Band integrals use cumulative sums that are computed once per spectrum, so
+    every band afterwards costs two binary searches.
+    """
+    def __init__(self, energy, counts, unconvoluted=None, metadata=None):
+        self.energy = np.ascontiguousarray(energy, dtype=float)
+        self.counts = np.ascontiguousarray(np.atleast_2d(counts), dtype=float)
+        self.unconvoluted = (None if unconvoluted is None else
+                             np.ascontiguousarray(np.atleast_2d(unconvoluted), dtype=float))
+        self.metadata = metadata or {}
+        self._cumsums = {}
+
+    @classmethod
+    def from_rows(cls, rows, unconvoluted_rows=None, metadata=None):
+        """from [energy, counts interaction 1, ...] rows (the old get_spectrum() format)"""
+        rows = np.array(rows, dtype=float, ndmin=2)
+        unconvoluted = None
+        if unconvoluted_rows is not None and len(unconvoluted_rows):
+            unconvoluted = np.array(unconvoluted_rows, dtype=float, ndmin=2)[:,1:].T
+        return cls(rows[:,0], rows[:,1:].T, unconvoluted, metadata)
+
+    @classmethod
+    def from_csv(cls, file):
+        """from a csv export of XMI-MSIM (channel, energy, counts, ... per line)"""
+        data = np.loadtxt(file, delimiter=',', ndmin=2)
+        return cls(data[:,1], data[:,2:].T, metadata={'file': file})
+
+    @classmethod
+    def from_xmso(cls, file):
+        """from a .xmso file, with both the convoluted and unconvoluted spectrum"""
+        results = read_xmso(file, histories=False)
+        metadata = dict(results['metadata'], file=file)
+        return cls.from_rows(results['spectrum_conv'], results['spectrum_unconv'], metadata)
+
+    def __len__(self):
+        return len(self.energy)
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return [self[i] for i in range(*n.indices(len(self)))]
+        return [self.energy[n].item(), *self.counts[:,n].tolist()]
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+
+    def __repr__(self):
+        return '<xmimsim.Spectrum {} channels, {} interactions, {:g}-{:g} keV>'.format(
+            len(self), len(self.counts), self.energy[0], self.energy[-1])
+
+    def tolist(self):
+        """the spectrum as a list of [energy, counts interaction 1, ...] rows"""
+        return np.column_stack([self.energy, self.counts.T]).tolist()
+
+    def channels(self, low, high):
+        """index range (start, stop) of the channels with low <= energy <= high"""
+        low, high = min(low, high), max(low, high)
+        return (int(np.searchsorted(self.energy, low, 'left')),
+                int(np.searchsorted(self.energy, high, 'right')))
+
+    def cumsum(self, order=-1, convoluted=True, truncate=False):
+        """
+        cumulative sum of the counts of one interaction order, starting at 0.
+        truncate=True sums the counts of every channel rounded down to an
+        integer, the way count_photons() counts photons
+        """
+        key = (order % len(self.counts), convoluted, truncate)
+        if key not in self._cumsums:
+            counts = (self.counts if convoluted else self.unconvoluted)[order]
+            if truncate:
+                counts = np.trunc(counts)
+            cumsum = np.zeros(len(counts)+1)
+            np.cumsum(counts, out=cumsum[1:])
+            self._cumsums[key] = cumsum
+        return self._cumsums[key]
+
+    def integrate(self, low, high, order=-1, convoluted=True):
+        """sum of the counts in the channels with low <= energy <= high"""
+        start, stop = self.channels(low, high)
+        cumsum = self.cumsum(order, convoluted)
+        return float(cumsum[stop] - cumsum[start])
+
+    def photons(self, low, high, order=-1, convoluted=True):
+        """integer number of photons between low and high, as count_photons() returns it"""
+        start, stop = self.channels(low, high)
+        cumsum = self.cumsum(order, convoluted, truncate=True)
+        return int(cumsum[stop] - cumsum[start])
+
+
+def band_weights(energy, bands, overlap=False):
+    """
+    (channels, bands) matrix with the weight of every channel in every band
+    
+    Without overlap a channel counts fully if low <= energy <= high, like in
+    count_photons(). With overlap every channel is taken as a bin reaching halfway
+    to its neighbours and weighted by the fraction of the bin inside the band.
+    """
+    energy = np.asarray(energy, dtype=float)
+    spans = np.array([[min(span), max(span)] for span in bands.values()], dtype=float).reshape(-1, 2)
+    low, high = spans[:,0], spans[:,1]
+    if not overlap:
+        return ((energy[:,None] >= low) & (energy[:,None] <= high)).astype(float)
+    middle = (energy[1:] + energy[:-1])/2
+    first = energy[0] - (middle[0] - energy[0]) if len(middle) else energy[0] - .5
+    last = energy[-1] + (energy[-1] - middle[-1]) if len(middle) else energy[-1] + .5
+    edges = np.concatenate([[first], middle, [last]])
+    inside = (np.minimum(edges[1:,None], high) - np.maximum(edges[:-1,None], low)).clip(min=0)
+    return inside/np.diff(edges)[:,None]
+
+
+def count_bands(spectra, bands, overlap=False, order=-1, convoluted=True, truncate=False):
+    """
+    Integrates many bands over many spectra at once
+    
+    Usage
+    -------------
+    bands = {'k_a_Fe':[6.098,6.744],'k_b_Fe':[6.7801,7.340]}
+    matrix = xmimsim.count_bands([xm.get_spectrum() for xm in models], bands)
+    matrix[:,0] is k_a_Fe for every model
+    
+    Arguments
+    -------------
+    spectra: list of xmimsim.Spectrum (or lists of [energy, counts] rows)
+    bands: dictionary in the format of count_photons(**bands), the columns of the
+     result are in the order of its keys
+    overlap: weight channels by the fraction that overlaps the band, see band_weights()
+    order: interaction order to use, default the highest
+    convoluted: use the unconvoluted spectra if False
+    truncate: round every channel down to an integer first, as count_photons() does
+    
+    Returns
+    -------------
+    a numpy array of shape (len(spectra), len(bands)). Spectra sharing an energy
+    grid (i.e. the same detector settings) are done in one matrix product.
+    """
+    spectra = [spectrum if isinstance(spectrum, Spectrum) else Spectrum.from_rows(spectrum)
+               for spectrum in spectra]
+    result = np.zeros((len(spectra), len(bands)))
+    grids = {}
+    for n, spectrum in enumerate(spectra):
+        grids.setdefault(spectrum.energy.tobytes(), []).append(n)
+    for indices in grids.values():
+        weights = band_weights(spectra[indices[0]].energy, bands, overlap)
+        counts = np.array([(spectra[n].counts if convoluted else spectra[n].unconvoluted)[order]
+                           for n in indices])
+        if truncate:
+            counts = np.trunc(counts)
+        result[indices] = counts @ weights
+    return result
@@ -0,0 +1,120 @@
+import glob, json, os, threading
+import numpy as np
+from .spectrum import Spectrum
+
+
+class SpectrumStore():
+    """
+    Append-only binary store for many spectra, e.g. all results of a sweep
+    
+    The spectra are kept in path.bin as raw float64 blocks (energy, then the
+    convoluted counts per interaction, then the unconvoluted counts if present)
+    and path.idx holds one json line per spectrum with its key and position.
+    Reading memory-maps path.bin, so a Spectrum from the store is a view into
+    the file: nothing is parsed or copied until it's used.
+    
+    Keys are normally the model hash, i.e. the filename calculate() gave the model.
+    
+    Usage
+    -------------
+    store = xmimsim.SpectrumStore('sweep1')
+    store.add_model(xm)                   # after xm.calculate()
+    store.import_folder('xmi')            # convert existing csv/xmso results
+    store[xm.filename].photons(6.098,6.744)
+    
+    Only one process should write to a store at a time (threads are fine);
+    any number can read.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.datafile = path + '.bin'
+        self.indexfile = path + '.idx'
+        self.index = {}
+        self._lock = threading.Lock()
+        self._map = None
+        if os.path.isfile(self.indexfile):
+            with open(self.indexfile, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.index[entry['key']] = entry
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def keys(self):
+        return list(self.index)
+
+    def add(self, key, spectrum):
+        """appends a xmimsim.Spectrum under key (a later add with the same key wins)"""
+        blocks = [spectrum.energy[None,:], spectrum.counts]
+        if spectrum.unconvoluted is not None:
+            blocks.append(spectrum.unconvoluted)
+        data = np.ascontiguousarray(np.concatenate(blocks), dtype='<f8')
+        with self._lock:
+            with open(self.datafile, 'ab') as f:
+                offset = f.seek(0, os.SEEK_END)
+                f.write(data.tobytes())
+            entry = {'key': key, 'offset': offset, 'channels': len(spectrum),
+                     'orders': len(spectrum.counts), 'unconvoluted': spectrum.unconvoluted is not None}
+            # the index line goes last, so readers never see half written spectra
+            with open(self.indexfile, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+            self.index[key] = entry
+        return self
+
+    def add_file(self, key, file):
+        """converts a .csv or .xmso result of XMI-MSIM into the store"""
+        if file.endswith('.xmso'):
+            return self.add(key, Spectrum.from_xmso(file))
+        return self.add(key, Spectrum.from_csv(file))
+
+    def add_model(self, xm):
+        """
+        adds the spectrum of a calculated model under its filename (the model hash),
+        or its cache key if it was calculated with a cache (no filename), else model.key()
+        """
+        spectrum = xm.spectrum if hasattr(xm, 'spectrum') else xm.get_spectrum()
+        if not isinstance(spectrum, Spectrum):
+            spectrum = Spectrum.from_rows(spectrum)
+        key = getattr(xm, 'filename', None) or getattr(xm, 'cache_key', None) or xm.key()
+        return self.add(key, spectrum)
+
+    def import_folder(self, folder, skip_existing=True):
+        """
+        converts every .xmso and .csv in folder, keyed by the file name without
+        extension. If both exist the .xmso is used, since it also holds the
+        unconvoluted spectrum. Returns the list of keys added
+        """
+        files = {}
+        for file in sorted(glob.glob(os.path.join(folder, '*.csv'))) + sorted(glob.glob(os.path.join(folder, '*.xmso'))):
+            files[os.path.splitext(os.path.basename(file))[0]] = file
+        added = []
+        for key, file in files.items():
+            if skip_existing and key in self:
+                continue
+            self.add_file(key, file)
+            added.append(key)
+        return added
+
+    def _data(self, end):
+        if self._map is None or len(self._map)*8 < end:
+            self._map = np.memmap(self.datafile, dtype='<f8', mode='r')
+        return self._map
+
+    def __getitem__(self, key):
+        """the spectrum stored under key, as a xmimsim.Spectrum of memory-mapped views"""
+        entry = self.index[key]
+        rows = 1 + entry['orders']*(2 if entry['unconvoluted'] else 1)
+        start = entry['offset']//8
+        block = self._data(entry['offset'] + 8*rows*entry['channels'])[start:start+rows*entry['channels']]
+        block = block.reshape(rows, entry['channels'])
+        orders = entry['orders']
+        unconvoluted = block[1+orders:] if entry['unconvoluted'] else None
+        return Spectrum(block[0], block[1:1+orders], unconvoluted, {'key': key})
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
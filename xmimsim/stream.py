@@ -0,0 +1,83 @@
+import collections, queue, re, threading
+
+PROGRESS = re.compile(r'(\d+(?:\.\d+)?)\s*%')
+TAIL = 50 # lines of output kept in model.output
+
+
+class Stalled(RuntimeError):
+    """XMI-MSIM printed nothing for longer than stall_timeout and was killed"""
+
+
+def parse_progress(line):
+    """the percentage in a progress line of XMI-MSIM (e.g. 'Simulating interactions at 40 %'), else None"""
+    match = PROGRESS.search(line)
+    return float(match.group(1)) if match else None
+
+
+def output_lines(process, stall_timeout=None):
+    """
+    yields the lines of process.stdout (decoded, without line ends) as they are
+    printed. If no line comes for stall_timeout seconds the process is killed
+    and Stalled raised
+    """
+    lines = queue.Queue()
+    def reader():
+        with process.stdout:
+            for line in process.stdout:
+                lines.put(line)
+        lines.put(None)
+    threading.Thread(target=reader, daemon=True).start()
+    while True:
+        try:
+            line = lines.get(timeout=stall_timeout)
+        except queue.Empty:
+            process.kill()
+            process.wait()
+            raise Stalled('no output from XMI-MSIM for {} s, killed it'.format(stall_timeout))
+        if line is None:
+            break
+        yield line.decode(errors='replace').rstrip('\r\n')
+    process.wait()
+
+
+def follow(xm, lines, progress=None, echo=False):
+    """keeps the tail of the output in xm.output and reports the progress lines"""
+    xm.output = collections.deque(maxlen=TAIL)
+    for line in lines:
+        take_line(xm, line, progress, echo)
+
+
+def take_line(xm, line, progress=None, echo=False):
+    xm.output.append(line)
+    if echo: print(line)
+    percent = parse_progress(line)
+    if percent is not None:
+        xm.progress = percent
+        if progress is not None: progress(xm, percent)
+
+
+def progress(xm, **kwargs):
+    """
+    Runs xm.calculate(**kwargs) in a thread and yields its progress in percent as
+    it comes, e.g.
+    
+    for percent in xmimsim.progress(xm, stall_timeout=600):
+        print(percent)
+    
+    Errors of the calculation (e.g. xmimsim.Stalled) are raised at the end
+    """
+    updates = queue.Queue()
+    done = object()
+    errors = []
+    def run():
+        try:
+            xm.calculate(progress=lambda xm, percent: updates.put(percent), **kwargs)
+        except BaseException as error:
+            errors.append(error)
+        finally:
+            updates.put(done)
+    threading.Thread(target=run, daemon=True).start()
+    for percent in iter(updates.get, done):
+        yield percent
+    if errors:
+        raise errors[0]
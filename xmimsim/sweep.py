@@ -0,0 +1,236 @@
+import copy, itertools, os, time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .result import Result
+from .spec import ModelSpec
+
+
+_SECTIONS = ('layers', 'excitation_path', 'detector_path', 'crystal', 'sources')
+_CACHED = ('base_xmsi', 'full_xmsi', 'filelocation', 'spectrum', 'returncode')
+
+
+def grid(**axes):
+    """
+    Builds the full cartesian product of the given axes as a list of variants
+    
+    Usage
+    -------------
+    xmimsim.grid(n_photons_line=[1e4,1e5], detector_live_time=[100,1000])
+    returns the four variant dictionaries that can be handed to xmimsim.sweep()
+    
+    Axes that change a layer or source are (section, index, key) tuples, which
+    can't be keywords, so use xmimsim.grid_from() for those, e.g. to vary the
+    thickness of the second sample layer:
+    xmimsim.grid_from({('layers',1,'thickness'): [0.01,0.02,0.03]})
+    """
+    return grid_from(axes)
+
+
+def grid_from(axes):
+    """same as xmimsim.grid() but takes a dictionary so tuple keys can be used"""
+    keys = list(axes)
+    return [dict(zip(keys, values)) for values in itertools.product(*[axes[k] for k in keys])]
+
+
+def apply_variant(xm, variant):
+    """
+    Applies a variant to a model in place and returns the model
+    
+    A variant is either
+     - a callable taking the model and returning the (modified) model
+     - a xmimsim.ModelSpec, which replaces the model
+     - a dictionary, in which plain keys are handed to model.set_parameters()
+       and (section, index, key) tuples set a value on a layer or source, e.g.
+       {('layers',1,'thickness'):0.02, ('sources',0,'energy'):17.4}
+    """
+    if isinstance(variant, ModelSpec):
+        return variant.to_model()
+    if callable(variant):
+        return variant(xm)
+    parameters = {}
+    for key, value in variant.items():
+        if isinstance(key, tuple):
+            section, index, name = key
+            if section not in _SECTIONS:
+                raise KeyError('unknown section {!r}, use one of {}'.format(section, _SECTIONS))
+            getattr(xm, section)[index][name] = value
+        else:
+            parameters[key] = value
+    return xm.set_parameters(**parameters)
+
+
+def derive(base, variant=None, index=None):
+    """
+    Returns an independent copy of base with variant applied (see apply_variant)
+    
+    Anything cached by a previous calculation is dropped so the copy is rendered
+    and named from its own parameters. If base has a filename set, the copy gets
+    filename_<index> so that the jobs of a sweep never share output files.
+    """
+    if isinstance(base, ModelSpec):
+        base = base.to_model()
+    xm = copy.deepcopy(base)
+    for attr in _CACHED:
+        xm.__dict__.pop(attr, None)
+    if getattr(xm, 'auto_filename', False):
+        # named by its hash, which is worked out again for the copy
+        del xm.filename, xm.auto_filename
+    if index is not None and 'filename' in xm.__dict__:
+        xm.filename = '{}_{}'.format(xm.filename, index)
+    if variant is not None:
+        xm = apply_variant(xm, variant)
+    return xm
+
+
+def run_job(xm, bands=None, **kwargs):
+    """
+    Calculates one model and collects its spectrum (and band counts) into a
+    xmimsim.Result. Exceptions are stored on the result instead of raised.
+    """
+    start = time.time()
+    try:
+        xm.calculate(**kwargs)
+        if getattr(xm, 'returncode', 0):
+            raise RuntimeError('XMI-MSIM exited with code {} for {}: {}'.format(
+                xm.returncode, xm.filelocation, '\n'.join(getattr(xm, 'output', ())).strip()))
+        spectrum = xm.get_spectrum()
+        counts = xm.count_photons(**bands) if bands else None
+    except Exception as error:
+        return Result(xm, error=error, elapsed=time.time()-start)
+    return Result(xm, spectrum, counts, elapsed=time.time()-start)
+
+
+def unique(models, **kwargs):
+    """
+    De-duplicates models by model.key(**kwargs)
+    
+    Returns (firsts, index): the first model of every distinct key, and for every
+    model the position of its representative in firsts
+    """
+    firsts, positions, index = [], {}, []
+    for xm in models:
+        key = xm.key(**kwargs)
+        if key not in positions:
+            positions[key] = len(firsts)
+            firsts.append(xm)
+        index.append(positions[key])
+    return firsts, index
+
+
+def warm_data(models, max_workers=None, **kwargs):
+    """
+    With calculate(data=...) in kwargs: computes the data files of the distinct
+    configurations among models up front with cheap runs (see
+    PrecomputedData.warm()), so the jobs don't wait for the first full run of
+    their configuration to finish
+    """
+    data = kwargs.get('data')
+    if data is not None and models:
+        data.warm(models, max_workers=max_workers, **dict(kwargs, progress=None))
+
+
+def sweep(base, variants, max_workers=None, bands=None, budget=None, cost=None, **kwargs):
+    """
+    Runs a batch of variants of one model in parallel
+    
+    Usage
+    -------------
+    results = xmimsim.sweep(xm, xmimsim.grid_from({('layers',1,'thickness'):[.01,.02,.04]}),
+                            max_workers=8, bands={'k_a_Fe':[6.098,6.744]}, set_threads=4)
+    
+    Arguments
+    -------------
+    base: the xmimsim.model (or ModelSpec) every job is derived from (base
+     itself is not modified)
+    variants: a list of variants, see xmimsim.apply_variant() and xmimsim.grid()
+    max_workers: number of simulations running at once (default os.cpu_count())
+    bands: optional dictionary in the format of model.count_photons(**bands)
+    budget: optional xmimsim.ThreadBudget, which then picks the number of
+     simulations at once and set_threads instead of max_workers
+    cost: optional xmimsim.CostModel; the jobs are then started longest predicted
+     first and (without a budget) their run times are added to it. A budget
+     uses it to compare the splits on jobs of different sizes
+    **kwargs: handed to model.calculate() for every job, so the flags, xmifolder,
+     export and force_overwrite behave exactly as for a single calculation. In
+     particular, finished jobs are picked up from their output files.
+    
+    Returns
+    -------------
+    a list of xmimsim.Result, one per variant and in the same order as variants.
+    A failing job does not stop the others; check result.ok / result.error.
+    
+    Variants that are the same model (same model.key(), e.g. a repeated point
+    or masses=[1,1] vs [50,50]) are simulated once and share the result.
+    
+    Since the work happens in the XMI-MSIM child processes, the jobs are
+    run from a thread pool. Keep max_workers * set_threads at or below the number
+    of cores of the machine. With data=xmimsim.PrecomputedData(...), the data
+    files of every configuration are computed first (see warm_data()).
+    """
+    jobs = [derive(base, variant, n) for n, variant in enumerate(variants)]
+    firsts, index = unique(jobs, **kwargs)
+    order = cost.order(firsts, **kwargs) if cost is not None else range(len(firsts))
+    warm_data(firsts, max_workers, **kwargs)
+    if budget is not None:
+        ran = budget.run([firsts[n] for n in order], bands, cost=cost, **kwargs)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+            futures = [pool.submit(run_job, firsts[n], bands, **kwargs) for n in order]
+            ran = [future.result() for future in futures]
+        if cost is not None:
+            cost.record(ran, **kwargs)
+    done = [None]*len(firsts)
+    for n, result in zip(order, ran):
+        done[n] = result
+    results = []
+    for xm, n in zip(jobs, index):
+        result = done[n]
+        if result.model is not xm:
+            # a repeated point: point it at the files of the one that was simulated
+            for attr in ('filename', 'filelocation'):
+                if hasattr(result.model, attr):
+                    setattr(xm, attr, getattr(result.model, attr))
+            result = Result(xm, result.spectrum, result.counts, result.error, result.elapsed)
+        results.append(result)
+    return results
+
+
+def iter_sweep(base, variants, max_workers=None, bands=None, backlog=None, **kwargs):
+    """
+    sweep() that yields every xmimsim.Result as soon as its simulation finishes
+    
+    Usage
+    -------------
+    for result in xmimsim.iter_sweep(xm, variants, max_workers=8, bands=bands, backlog=4):
+        fit(result.spectrum)        # runs while the next simulations do
+    
+    Results come in the order they finish, result.index is the position of the
+    variant. variants may be any iterable, e.g. a generator, and is only read
+    as far as needed: at most max_workers jobs run and at most backlog (default
+    max_workers) finished results wait to be taken, so a slow consumer holds
+    back the submission of new jobs and memory stays flat however long the
+    sweep. For the same reason repeated points are not de-duplicated as in
+    sweep(), but with force_overwrite=False they pick up the files of the
+    first one. Leaving the loop early cancels the jobs that haven't started.
+    """
+    max_workers = max_workers or os.cpu_count()
+    limit = max_workers + (max_workers if backlog is None else backlog)
+    variants = iter(enumerate(variants))
+    pending = {}
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        while True:
+            batch = [(n, derive(base, variant, n))
+                     for n, variant in itertools.islice(variants, limit - len(pending))]
+            warm_data([xm for n, xm in batch], max_workers, **kwargs)
+            for n, xm in batch:
+                pending[pool.submit(run_job, xm, bands, **kwargs)] = n
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                result.index = pending.pop(future)
+                yield result
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
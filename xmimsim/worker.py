@@ -0,0 +1,29 @@
+"""
+Worker for a xmimsim.WorkQueue:
+
+python -m xmimsim.worker /shared/xmi-queue [--lease 600] [--retries 2] [--poll 5]
+                                           [--exit-when-empty] [--max-jobs N]
+"""
+import argparse
+from .workqueue import work
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m xmimsim.worker',
+                                     description='works off the jobs of a xmimsim.WorkQueue')
+    parser.add_argument('root', help='folder of the queue')
+    parser.add_argument('--lease', type=float, default=600,
+                        help='seconds without a sign of life after which a job is given to another worker')
+    parser.add_argument('--retries', type=int, default=2, help='times a failed job is tried again')
+    parser.add_argument('--poll', type=float, default=5, help='seconds between looks for new jobs')
+    parser.add_argument('--exit-when-empty', action='store_true',
+                        help='stop once no job is pending or running instead of waiting for more')
+    parser.add_argument('--max-jobs', type=int, default=None, help='stop after this many jobs')
+    parser.add_argument('--name', default=None, help='name of the worker in the results')
+    args = parser.parse_args(argv)
+    work(args.root, lease=args.lease, retries=args.retries, poll=args.poll,
+         exit_when_empty=args.exit_when_empty, max_jobs=args.max_jobs, name=args.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+import os, pickle, socket, subprocess, sys, tempfile, threading, time
+from .sweep import derive, run_job
+from .profile import profiling
+from .result import Result
+
+STATES = ('pending', 'claimed', 'done', 'failed', 'results')
+
+
+class WorkQueue():
+    """
+    A queue of calculations in a (shared) folder, worked off by any number of workers
+
+    Usage
+    -------------
+    queue = xmimsim.WorkQueue('/shared/xmi-queue')
+    ids = queue.submit_sweep(xm, variants, bands={'k_a_Fe':[6.098,6.744]}, set_threads=4)
+
+    then on every host (or queue.run_local(processes=8) on this one):
+    python -m xmimsim.worker /shared/xmi-queue
+
+    results = queue.collect(ids)    # waits, a list of xmimsim.Result like sweep()
+
+    A job is a pickled model with its bands and calculate() options in
+    pending/. A worker claims it by renaming it into claimed/, which only one
+    of them can do, and keeps touching it while it runs (the lease). Jobs whose
+    lease is older than lease seconds belong to a dead worker and are put back
+    into pending/ by the next worker looking for work. A job that failed is
+    retried until it has been tried retries+1 times, then it goes to failed/.
+    Results are pickled xmimsim.Result in results/, with the worker, host,
+    attempts and the timing of the phases of the run (see xmimsim.profiling())
+    in result.worker, result.host, result.attempts and result.timing.
+
+    Everything is plain files and renames, so it works on any filesystem shared
+    by the hosts that has atomic rename (e.g. NFS, but not some object stores).
+    The job id is model.key() of the job, so submitting the same point twice
+    runs it once. Relative xmifolders are made absolute when a job is
+    submitted, since the workers run elsewhere.
+    """
+    def __init__(self, root, lease=600, retries=2):
+        self.root = os.path.abspath(root)
+        self.lease = lease
+        self.retries = retries
+        for state in STATES + ('tmp',):
+            os.makedirs(os.path.join(self.root, state), exist_ok=True)
+
+    def path(self, state, id, extension='job'):
+        return os.path.join(self.root, state, '{}.{}'.format(id, extension))
+
+    def _write(self, path, item):
+        """pickles item to path atomically"""
+        handle, partial = tempfile.mkstemp(dir=os.path.join(self.root, 'tmp'))
+        with os.fdopen(handle, 'wb') as f:
+            pickle.dump(item, f)
+        os.replace(partial, path)
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def submit(self, xm, bands=None, force=False, **kwargs):
+        """queues a calculation of xm with the options of calculate(), returns its id"""
+        if kwargs.get('xmifolder', 'xmi') is not None:
+            kwargs['xmifolder'] = os.path.abspath(kwargs.get('xmifolder', 'xmi'))
+        id = xm.key(**kwargs)
+        if not force and any(os.path.exists(self.path(state, id)) for state in ('pending', 'claimed', 'done')):
+            return id
+        self._write(self.path('pending', id), {'id': id, 'model': xm, 'bands': bands,
+                                               'kwargs': kwargs, 'attempts': 0})
+        return id
+
+    def submit_sweep(self, base, variants, bands=None, **kwargs):
+        """submit() for every variant of base, see xmimsim.sweep(). Returns the ids"""
+        return [self.submit(derive(base, variant, n), bands, **kwargs) for n, variant in enumerate(variants)]
+
+    def ids(self, state):
+        folder = os.path.join(self.root, state)
+        return sorted(name.rsplit('.', 1)[0] for name in os.listdir(folder) if not name.startswith('.'))
+
+    def status(self):
+        """number of jobs in every state"""
+        return {state: len(self.ids(state)) for state in STATES}
+
+    def claim(self):
+        """moves the next pending job to claimed/ and returns it, or None if there is none"""
+        self.requeue_expired()
+        for id in self.ids('pending'):
+            try:
+                #the lease starts now: rename keeps the mtime of the submission
+                os.utime(self.path('pending', id))
+                os.rename(self.path('pending', id), self.path('claimed', id))
+            except OSError: # another worker was faster
+                continue
+            try:
+                return self._read(self.path('claimed', id))
+            except OSError: # taken back meanwhile, it's lost to us
+                continue
+        return None
+
+    def renew(self, id):
+        """extends the lease of a claimed job"""
+        try:
+            os.utime(self.path('claimed', id))
+        except OSError:
+            pass
+
+    def requeue_expired(self):
+        """puts jobs whose lease ran out back into pending/ (or failed/)"""
+        now = time.time()
+        for id in self.ids('claimed'):
+            try:
+                expired = now - os.path.getmtime(self.path('claimed', id)) > self.lease
+            except OSError:
+                continue
+            if expired:
+                self._retry(id)
+
+    def _retry(self, id, result=None):
+        """back to pending/ after a failed try, or to failed/ (publishing result) after the last"""
+        #take the job out of claimed/ first, so only one worker handles it
+        taken = os.path.join(self.root, 'tmp', '{}.{}.retry'.format(id, os.getpid()))
+        try:
+            os.rename(self.path('claimed', id), taken)
+        except OSError:
+            return
+        job = self._read(taken)
+        job['attempts'] += 1
+        if job['attempts'] <= self.retries:
+            self._write(self.path('pending', id), job)
+        else:
+            if result is None:
+                result = Result(job['model'], error=RuntimeError('lease expired {} times'.format(job['attempts'])))
+            result.attempts = job['attempts']
+            self._write(self.path('results', id, 'result'), result)
+            self._write(self.path('failed', id), job)
+        os.remove(taken)
+
+    def complete(self, job, result):
+        """publishes the result of a claimed job; failed jobs are retried"""
+        id = job['id']
+        result.attempts = job['attempts'] + 1
+        try:
+            pickle.dumps(result.error)
+        except Exception:
+            result.error = RuntimeError(repr(result.error))
+        if result.ok:
+            self._write(self.path('results', id, 'result'), result)
+            try:
+                os.rename(self.path('claimed', id), self.path('done', id))
+            except OSError: # the lease ran out meanwhile, the result is there anyway
+                pass
+        else:
+            self._retry(id, result)
+
+    def result(self, id):
+        """the xmimsim.Result of a finished job, or None"""
+        try:
+            return self._read(self.path('results', id, 'result'))
+        except FileNotFoundError:
+            return None
+
+    def collect(self, ids, poll=5, timeout=None):
+        """waits for the results of ids and returns them in order"""
+        start = time.time()
+        results = {}
+        while True:
+            for id in set(ids) - set(results):
+                result = self.result(id)
+                if result is not None:
+                    results[id] = result
+            if len(results) == len(set(ids)):
+                return [results[id] for id in ids]
+            if timeout is not None and time.time() - start > timeout:
+                raise TimeoutError('{} of {} jobs not finished'.format(len(set(ids)) - len(results), len(set(ids))))
+            time.sleep(poll)
+
+    def run_local(self, processes=None, **options):
+        """
+        runs processes workers (default os.cpu_count()) on this machine until the
+        queue is empty, the same way as on other hosts. options as for work()
+        """
+        env = dict(os.environ)
+        package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [package, env.get('PYTHONPATH')]))
+        cmd = [sys.executable, '-m', 'xmimsim.worker', self.root, '--exit-when-empty',
+               '--lease', str(self.lease), '--retries', str(self.retries)]
+        for option, value in options.items():
+            cmd += ['--' + option.replace('_', '-'), str(value)]
+        workers = [subprocess.Popen(cmd, env=env) for _ in range(processes or os.cpu_count())]
+        return [worker.wait() for worker in workers]
+
+
+def work(root, lease=600, retries=2, poll=5, exit_when_empty=False, max_jobs=None, name=None):
+    """
+    The loop of python -m xmimsim.worker: claims jobs from the WorkQueue in root,
+    calculates them and publishes the results. Returns the number of jobs run
+    """
+    queue = WorkQueue(root, lease, retries)
+    name = name or '{}:{}'.format(socket.gethostname(), os.getpid())
+    count = 0
+    while max_jobs is None or count < max_jobs:
+        job = queue.claim()
+        if job is None:
+            if exit_when_empty and not queue.ids('claimed'):
+                break
+            time.sleep(poll)
+            continue
+        #keep the lease while the job runs
+        stop = threading.Event()
+        def heartbeat(id):
+            while not stop.wait(lease/4):
+                queue.renew(id)
+        threading.Thread(target=heartbeat, args=(job['id'],), daemon=True).start()
+        try:
+            with profiling() as profile:
+                result = run_job(job['model'], job['bands'], **job['kwargs'])
+        finally:
+            stop.set()
+        result.worker = name
+        result.host = socket.gethostname()
+        result.timing = profile.summary()
+        queue.complete(job, result)
+        count += 1
+    return count
@@ -1,6 +1,70 @@
-import subprocess, hashlib, os, re
+import subprocess, hashlib, os, re, contextlib, shutil, tempfile
 from .strings import s_main, s_layer, s_element, s_source, s_header
-from .func import XMIMSIM_BINARY, get_elements, xyz_update
+from .func import XMIMSIM_BINARY, get_elements, xyz_update, binary_not_found, move_file, scratch_folder
+from .aio import calculate_async
+from .spectrum import Spectrum
+from .noise import realizations
+from .canonical import canonical
+from .response import convolve, reference_detector, DETECTOR_PARAMETERS
+from .profile import timed, Popen
+from .stream import output_lines, follow
+
+
+def render_layer(layer):
+    """the xml of one layer (or absorber/crystal layer)"""
+    elements = ''.join([s_element.format(atom,weight) for atom,weight in layer['elements'].items()])
+    return s_layer.format(**dict(layer, elements=elements))
+
+
+def render_source(sourceupdate):
+    """the xml of one source"""
+    source = {'sigma_x':0,'sigma_y':0,'sigma_xp':0,'sigma_yp':0}
+    other_string=''
+    if 'gaussian' in source:
+        string='\n      <scale_parameter distribution_type="gaussian">{}</scale_parameter>'    
+        other_string += string.format(source['gaussian'])
+    source.update({'other':other_string})
+    source.update(sourceupdate)
+    return s_source.format(**source)
+
+
+def _layer_token(layer):
+    """what render_layer() depends on, with the types: 1 and 1.0 render differently"""
+    elements, density, thickness = layer['elements'], layer['density'], layer['thickness']
+    return (tuple(elements.items()), tuple(map(type, elements.values())), tuple(map(type, elements)),
+            density, type(density), thickness, type(thickness))
+
+
+SOURCE_FIELDS = ('energy', 'horizontal_intensity', 'vertical_intensity', 'other',
+                 'sigma_x', 'sigma_y', 'sigma_xp', 'sigma_yp')
+
+def _source_token(source):
+    """what render_source() depends on, with the types"""
+    values = tuple([source.get(field) for field in SOURCE_FIELDS])
+    return (None,) + values + tuple(map(type, values))
+
+
+class _Fragments(dict):
+    """
+    rendered layers and sources by their token, shared by a model and its
+    copies (copy.deepcopy() and derive() hand on the same cache) and left
+    behind when a model is pickled
+    """
+    size = 65536
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (_Fragments, ())
+
+    def get_or_render(self, token, render, item):
+        text = self.get(token)
+        if text is None:
+            if len(self) >= self.size:
+                self.clear()
+            text = self[token] = render(item)
+        return text
 
 
 class model():
@@ -56,6 +120,9 @@ class model():
         
         """
         self.parameters.update(kwargs)
+        if getattr(self, 'python_detector', False) and any(k in DETECTOR_PARAMETERS for k in kwargs):
+            #the simulation stays valid, only the convolution has to be redone
+            self.__dict__.pop('spectrum', None)
         return self
        
     def add_layer(self,*args, **kwargs): 
@@ -294,7 +361,7 @@ class model():
         return self
 
     def remove_all_layers(self):
-        self.layers
+        self.layers = []
         return self
 
     def remove_all_excitation_path(self):
@@ -309,6 +376,11 @@ class model():
         self.crystal = []
         return self    
 
+    def spec(self):
+        """an immutable snapshot of the model, see xmimsim.ModelSpec"""
+        from .spec import ModelSpec
+        return ModelSpec.from_model(self)
+
     def set_filename(self,name):
         """
         You may set a filename with xmimsim.model.set_filename()
@@ -317,11 +389,12 @@ class model():
          with the same name, you will overwrite the second file with the first
         
         If you don't set a filename then the default filename assigned at
-        calculation is an sha224 hash of the parameters. This doesn't help you
+        calculation is an sha224 hash of the parameters (see model.key()). This doesn't help you
         find that csv file you're looking for easily, BUT it will keep you from
         overwriting your data.
         """
         self.filename = name
+        self.auto_filename = False
         return self
 
     def remove_filename(self):
@@ -329,42 +402,47 @@ class model():
             del self.filename
         except:
             print('no filename defined')
+        #back to naming by the model hash
+        self.auto_filename = True
         return self        
 
+    def sections(self):
+        """
+        the rendered xml of the layers, absorbers, crystal and sources, as used by
+        generate_base_xmsi(). Every layer and source is rendered once and then
+        taken from a cache (shared with the copies of the model) keyed by the
+        values it is rendered from and their types, so a variant that changes
+        one layer thickness only renders that layer again
+        """
+        fragments = self.__dict__.get('_fragments')
+        if fragments is None:
+            fragments = self._fragments = _Fragments()
+        fragment = fragments.get_or_render
+        sections = {section:''.join([fragment(_layer_token(item), render_layer, item) for item in getattr(self, section)])
+                    for section in ('layers', 'excitation_path', 'detector_path', 'crystal')}
+        sections['excitation'] = ''.join([fragment(_source_token(item), render_source, item) for item in self.sources])
+        return sections
+
     def full_parameters(self):
-        def parameterupdate(parameters,layer_str,layers):
-            layers_string = ''
-            for layer in layers:
-                layer['elements'] = ''.join([s_element.format(atom,weight) for atom,weight in layer['elements'].items()])
-                layers_string += s_layer.format(**layer)
-            parameters.update({layer_str:layers_string})
-        parameterupdate(self.parameters,'layers',self.layers)
-        parameterupdate(self.parameters,'excitation_path',self.excitation_path)
-        parameterupdate(self.parameters,'detector_path',self.detector_path)
-        parameterupdate(self.parameters,'crystal',self.crystal)
-        sourcestring = ''
-        for sourceupdate in self.sources:
-            source = {'sigma_x':0,'sigma_y':0,'sigma_xp':0,'sigma_yp':0}
-            other_string=''
-            if 'gaussian' in source:
-                string='\n      <scale_parameter distribution_type="gaussian">{}</scale_parameter>'    
-                other_string += string.format(source['gaussian'])
-            source.update({'other':other_string})
-            source.update(sourceupdate)
-            sourcestring += s_source.format(**source)
-        self.parameters.update({'excitation':sourcestring})
+        self.parameters.update(self.sections())
         return self
     
-    def generate_base_xmsi(self,**kwargs):        
-        self.full_parameters()
-        self.base_xmsi = s_main.format(**self.parameters)
+    def generate_base_xmsi(self,**kwargs):
+        """
+        renders the input file (without the header naming the output file) from the
+        current state of the model and returns it. kwargs override parameters
+        for this rendering only. Can be called any number of times.
+        """
+        self.base_xmsi = s_main.format(**{**self.parameters, **self.sections(), **kwargs})
         return self.base_xmsi
 
     def calculate(self, xmifolder='xmi' , save_xmsi=True, save_xmso=False , export='csv-file',
                   force_overwrite = False, M_lines=True, auger_cascade=True, 
                   radiative_cascade=True, variance_reduction=True, pile_up=False, 
                   escape_peaks=True, poisson=False, opencl=False, 
-                  advanced_compton=False, default_seeds=False, set_threads='max',**kwargs):
+                  advanced_compton=False, default_seeds=False, set_threads='max',
+                  python_detector=False, cache=None, progress=None, stall_timeout=None,
+                  verbose=True, data=None, scratch=None, extra_args=None, **kwargs):
         """
         Calculation Options
         ------------
@@ -395,6 +473,25 @@ class model():
          - possible options are 'spe-file', 'csv-file', 'svg-file' or 'htm-file'
          - add '-unconvoluted' to save w/o detector conv. e.g. export = 'csv-file-unconvoluted'
 
+        cache = xmimsim.ResultCache(root, max_bytes)
+         - keep the results in a shared, size bounded cache instead of xmifolder.
+           The files are named by a key over all inputs, flags and the export
+           format, and set_filename() is ignored. See xmimsim.ResultCache
+
+        scratch = 'path' (or True)
+         - run in a private folder under path (True: /dev/shm if available, else
+           the temporary folder) and only move the files that are kept (the
+           export, and the .xmsi/.xmso if saved) to xmifolder or the cache when
+           the run succeeded. Saves the I/O of the intermediate files on slow
+           (e.g. network) filesystems
+
+        data = xmimsim.PrecomputedData(root)
+         - compute the solid angle grids and escape ratios once per configuration
+           and share them between runs, see xmimsim.PrecomputedData. A run that
+           has to compute them holds their lock for its whole simulation, so
+           call data.warm(models) before starting runs in parallel yourself
+           (sweep() and iter_sweep() do)
+
         Physics
         ------------
         The following options will change your answer:
@@ -413,120 +510,308 @@ class model():
          - advanced-compton=True: Enable advanced yet slower Compton simulation
          - set-threads=NTHREADS: Sets the number of threads to NTHREADS (default=max)
          - default-seeds=True: Use default seeds for reproducible simulation results
+         - extra_args=[...]: more command line arguments for XMI-MSIM. They don't
+           change the file name, so use them for options that don't change the
+           result, or set a seed_tag (see xmimsim.paired())
 
+        Detector
+        -------------
+         - python_detector=True: only simulate the unconvoluted spectrum (on a fixed
+           fine grid) and apply the detector response in python when the spectrum
+           is read. detector_gain, detector_zero, detector_fano, detector_noise
+           and detector_nchannels then don't change the file name, so changing
+           them reuses the simulation and costs milliseconds. Escape peaks and
+           pile-up are not part of the python detector response.
+
+        Progress
+        -------------
+        The output of XMI-MSIM is read line by line while it runs, its last lines
+        are kept in xm.output and the last percentage in xm.progress
+         - progress=callable: called as progress(xm, percent) for every progress
+           line, see also xmimsim.progress() to iterate over them
+         - stall_timeout=seconds: kill XMI-MSIM and raise xmimsim.Stalled if it
+           prints nothing for this long
+         - verbose=False: don't print the output
+         XMI-MSIM is run with --verbose (which prints the progress) if either
+         progress or stall_timeout is given.
+        If XMI-MSIM fails, xm.returncode is its exit code and nothing is cleaned
+        up or collected (xm.output tells what happened).
             
+        """
+        needs_run = self.prepare(xmifolder=xmifolder, export=export, force_overwrite=force_overwrite,
+                                 M_lines=M_lines, auger_cascade=auger_cascade,
+                                 radiative_cascade=radiative_cascade, variance_reduction=variance_reduction,
+                                 pile_up=pile_up, escape_peaks=escape_peaks, poisson=poisson, opencl=opencl,
+                                 advanced_compton=advanced_compton, default_seeds=default_seeds,
+                                 set_threads=set_threads, python_detector=python_detector, cache=cache,
+                                 data=data, scratch=scratch, extra_args=extra_args)
+        if needs_run:
+            cmd = self.cmd + (['--verbose'] if progress or stall_timeout else [])
+            computing = (data.computing(self, variance_reduction=variance_reduction, escape_peaks=escape_peaks)
+                         if data is not None else contextlib.nullcontext())
+            with computing, timed('simulate', self) as event:
+                try:
+                    process = Popen(cmd, shell=(True if os.name=='nt' else False),
+                                    stderr=subprocess.STDOUT,
+                                    stdout=subprocess.PIPE)        
+                except:
+                    binary_not_found()
+                    return
+                try:
+                    follow(self, output_lines(process, stall_timeout), progress, echo=verbose)
+                except BaseException:
+                    #stalled, or the progress callback raised: don't leave XMI-MSIM running
+                    if process.poll() is None:
+                        process.kill()
+                        process.wait()
+                    self.returncode = process.returncode
+                    if hasattr(self, '_staged'): self.cleanup()
+                    raise
+                finally:
+                    event.update(returncode=process.returncode, cpu_seconds=process.cpu_seconds)
+                self.returncode = process.returncode
+            if self.returncode:
+                #failed: there is no output to clean up, the .xmsi stays for a look at it
+                if hasattr(self, '_staged'): self.cleanup()
+                return
+            with timed('collect', self):
+                self.cleanup(save_xmsi, save_xmso)
+
+    def prepare(self, xmifolder='xmi', export='csv-file', force_overwrite=False, M_lines=True,
+                auger_cascade=True, radiative_cascade=True, variance_reduction=True, pile_up=False,
+                escape_peaks=True, poisson=False, opencl=False, advanced_compton=False,
+                default_seeds=False, set_threads='max', python_detector=False, cache=None, data=None,
+                scratch=None, extra_args=None, **kwargs):
+        """
+        Does everything calculate() does before starting XMI-MSIM: names the files,
+        writes the .xmsi and builds the command line, which is stored in self.cmd.
+        Returns True if the simulation still has to be run (see force_overwrite)
+        
+        The options are the same as for calculate(). Useful if you want to launch
+        XMI-MSIM yourself, e.g. subprocess.run(xm.cmd) and then xm.cleanup()
+        Nothing is written if the results already exist.
         """
         #find folder and make it if it doesn't exist
         if xmifolder!=None:
             xmipath = os.path.join(os.getcwd(),xmifolder)
         else:
             xmipath = os.getcwd()
-        if not os.path.exists(xmipath):
-            os.mkdir(xmipath)
-        #make the full file
-        #make base_xmsi if that hasn't been done yet
-        try: self.base_xmsi
-        except: self.generate_base_xmsi()
-        #set the filename
-        try: self.filename
-        except:
-            base_string=self.base_xmsi.encode()
-            #add these tags to the sha to avoid using files made under different assumptions
-            if not M_lines:             base_string += ' --disable-M-lines'
-            if not auger_cascade:       base_string += ' --disable-auger-cascade'
-            if not radiative_cascade:   base_string += ' --disable-radiative-cascade'
-            if not variance_reduction:  base_string += ' --disable-variance-reduction'
-            if pile_up:                 base_string += ' --enable-pile-up'
-            if not escape_peaks:        base_string += ' --disable-escape-peaks'
-            if poisson:                 base_string += ' --enable-poisson'
-            self.filename=hashlib.sha224(base_string).hexdigest()
+        os.makedirs(xmipath, exist_ok=True)
+        #render the input from the current state of the model
+        self.python_detector = python_detector
+        with timed('render', self):
+            if python_detector:
+                #simulate on a reference detector, the real one is applied in get_spectrum()
+                base_xmsi = self.generate_base_xmsi(**reference_detector(self.sources))
+                if export is not None and not export.endswith('-unconvoluted'):
+                    export += '-unconvoluted'
+            else:
+                base_xmsi = self.generate_base_xmsi()
+            flags = self.command_flags(M_lines=M_lines, auger_cascade=auger_cascade,
+                                       radiative_cascade=radiative_cascade, variance_reduction=variance_reduction,
+                                       pile_up=pile_up, escape_peaks=escape_peaks, poisson=poisson, opencl=opencl,
+                                       advanced_compton=advanced_compton, default_seeds=default_seeds,
+                                       set_threads=set_threads)
+            if cache is None and getattr(self, 'auto_filename', True):
+                #set the filename, a hash of the model unless set_filename() was used
+                self.filename = self.key(python_detector=python_detector, flags=flags)
+                self.auto_filename = True
+        #options that don't change the result: shared data files and extra_args
+        run_options = (data.options(self, variance_reduction=variance_reduction, escape_peaks=escape_peaks)
+                       if data is not None else [])
+        run_options += list(extra_args or [])
+        scratch = scratch_folder(scratch) if scratch else None
+        if cache is not None:
+            needs_run = self._prepare_cached(cache, base_xmsi, flags, export, force_overwrite, scratch)
+            if needs_run: self.cmd += run_options
+            return needs_run
         filename = os.path.join(xmipath,self.filename)
-        self.full_xmsi=s_header.format(filename)+self.base_xmsi
         self.filelocation = filename    
+        exportformat = re.findall(r'\w+',export)[0] if export is not None else 'xmso'
+        output_file_exists=any([os.path.isfile(filename+'.xmso'), os.path.isfile(filename+'.'+exportformat)])
+        if not force_overwrite and output_file_exists:
+            #nothing to run, so nothing to write
+            self.cmd = None
+            return False
+        if scratch is not None:
+            #run in scratch, cleanup() moves the kept files to filename
+            self._staged = (None, None, exportformat, filename)
+            filename = os.path.join(tempfile.mkdtemp(dir=scratch), self.filename)
+            self.filelocation = filename
+        self.full_xmsi=s_header.format(filename)+base_xmsi
             
-        cmd = [XMIMSIM_BINARY, filename+'.xmsi']
-        if M_lines==False:              cmd.append('--disable-M-lines')
-        if auger_cascade==False:        cmd.append('--disable-auger-cascade')
-        if radiative_cascade==False:    cmd.append('--disable-radiative-cascade')
-        if variance_reduction==False:   cmd.append('--disable-variance-reduction')
-        if pile_up==True:               cmd.append('--enable-pile-up')
-        if escape_peaks==False:         cmd.append('--disable-escape-peaks')
-        if poisson==True:               cmd.append('--enable-poisson')
-        if opencl==True:                cmd.append('--enable-opencl')
-        if advanced_compton==True:      cmd.append('--enable-advanced-compton')
-        if default_seeds==True:         cmd.append('--enable-default-seeds')
-        if not set_threads=='max':      cmd.append('--set-threads=%'%set_threads)
-        
-        output_file_exists=os.path.isfile(filename+'.xmso')
+        cmd = [XMIMSIM_BINARY, filename+'.xmsi'] + flags + run_options
         if not export==None:
-            exportformat = re.findall(r'\w+',export)[0]
             cmd.append('--{}'.format(export))
             cmd.append('{}.{}'.format(filename,exportformat))
-            output_file_exists=any([output_file_exists,os.path.isfile(filename+'.'+exportformat)])
-        with open(filename+'.xmsi', 'w+') as f:
-            try:
-                f.write(self.full_xmsi)
-            except:
-                f.write(self.generate_xmsi())
-
-        if any([force_overwrite,not output_file_exists]):
-            try:
-                process = subprocess.Popen(cmd, shell=(True if os.name=='nt' else False),
-                                           stderr=subprocess.PIPE,
-                                           stdout=subprocess.PIPE)        
-                stdout, stderr = process.communicate()
-                if len(stdout)>0: print(stdout)
-                if len(stderr)>0: print(stderr)
-            except:
-                if os.name=='nt':
-                    print('Error: XMI-MSIM simulation software could not be located by your machine.',
-                    '',  
-                    'If you installed XMI-MSIM (the software, not this python package),', 
-                    'You must insert xmimsim-cli.exe into the enviroment variable path.', 
-                    'Go to My computer (right click) -> properties -> advanced -> advanced',
-                    '-> environment variables... -> Path and edit path by adding xmimsim-cli.exe',
-                    'directory into path (probably the path is something like',
-                    '"C:/Program Files/XMI-MSIM 64-bit/Bin/xmimsim-cli.exe" ',
-                    'but you will have to use "browse" to look for it at the exact location.',
-                    '',
-                    'Otherwise it will not be able to run on windows.',sep='\n')
-                else:
-                     print('Error:XMI-MSIM command not found (try running xmimsim --help from the command line)')
-            else:                        
-                #cleanup
-                if not save_xmsi:
-                    os.remove(filename+'.xmsi')
-                if not save_xmso:
-                    os.remove(filename+'.xmso')
+        with timed('write', self), open(filename+'.xmsi', 'w+') as f:
+            f.write(self.full_xmsi)
+        self.cmd = cmd
+        return True
+
+    def command_flags(self, M_lines=True, auger_cascade=True, radiative_cascade=True,
+                      variance_reduction=True, pile_up=False, escape_peaks=True, poisson=False,
+                      opencl=False, advanced_compton=False, default_seeds=False, set_threads='max', **kwargs):
+        """the XMI-MSIM command line options for the options of calculate()"""
+        flags = []
+        if M_lines==False:              flags.append('--disable-M-lines')
+        if auger_cascade==False:        flags.append('--disable-auger-cascade')
+        if radiative_cascade==False:    flags.append('--disable-radiative-cascade')
+        if variance_reduction==False:   flags.append('--disable-variance-reduction')
+        if pile_up==True:               flags.append('--enable-pile-up')
+        if escape_peaks==False:         flags.append('--disable-escape-peaks')
+        if poisson==True:               flags.append('--enable-poisson')
+        if opencl==True:                flags.append('--enable-opencl')
+        if advanced_compton==True:      flags.append('--enable-advanced-compton')
+        if default_seeds==True:         flags.append('--enable-default-seeds')
+        if not set_threads=='max':      flags.append('--set-threads={}'.format(set_threads))
+        return flags
+
+    def key(self, python_detector=False, flags=None, memo=None, **kwargs):
+        """
+        sha224 of the canonical form of the model (see xmimsim.canonical()) and the
+        options of calculate() that change the result. Equivalent models get the
+        same key, whatever the element order or number formatting. This names the
+        files of calculate() when no filename was set, keys the cache and is used
+        by xmimsim.sweep() to simulate repeated points only once.
+        
+        Takes the options of calculate(), e.g. xm.key(M_lines=False). flags and
+        memo are shortcuts for bulk use (see xmimsim.emit_xmsi())
+        """
+        if flags is None:
+            flags = self.command_flags(**kwargs)
+        #the thread count only matters for the result if the seeds are fixed
+        default_seeds = '--enable-default-seeds' in flags
+        settings = [flag for flag in flags if default_seeds or not flag.startswith('--set-threads')]
+        if python_detector:
+            settings.append('--python-detector')
+        #runs that only differ by their random seeds (e.g. shards) need their own files
+        if getattr(self, 'seed_tag', None) is not None:
+            settings.append('--seed-tag={}'.format(self.seed_tag))
+        text = canonical(self, exclude=DETECTOR_PARAMETERS if python_detector else (), memo=memo)
+        text += '\n' + '\n'.join(sorted(settings))
+        return hashlib.sha224(text.encode()).hexdigest()
+
+    def _prepare_cached(self, cache, base_xmsi, flags, export, force_overwrite, scratch=None):
+        with timed('render', self):
+            key = self.key(python_detector=self.python_detector, flags=flags + ['--export={}'.format(export)])
+        exportformat = re.findall(r'\w+',export)[0] if export is not None else 'xmso'
+        self.cache_key = key
+        if not force_overwrite and cache.lookup(key, exportformat):
+            self.filelocation = cache.location(key)
+            self.cmd = None
+            return False
+        filename = os.path.join(cache.staging(scratch), key)
+        self.full_xmsi=s_header.format(filename)+base_xmsi
+        self.filelocation = filename
+        self.cmd = [XMIMSIM_BINARY, filename+'.xmsi'] + flags
+        if export is not None:
+            self.cmd += ['--{}'.format(export), '{}.{}'.format(filename,exportformat)]
+        with timed('write', self), open(filename+'.xmsi', 'w') as f:
+            f.write(self.full_xmsi)
+        self._staged = (cache, key, exportformat, cache.location(key))
+        return True
+
+    def cleanup(self, save_xmsi=True, save_xmso=False):
+        """
+        removes the .xmsi and/or .xmso of the last calculation, as calculate() does.
+        With a cache or scratch, moves the kept results of a successful run into
+        the cache or xmifolder instead and removes the rest
+        """
+        job = self.__dict__.pop('_staged', None)
+        if job is not None:
+            cache, key, exportformat, destination = job
+            staging = self.filelocation
+            #keep only what a run that exited with 0 left (None: it never ran)
+            if getattr(self, 'returncode', 0) == 0:
+                extensions = [exportformat]
+                if save_xmso and exportformat!='xmso': extensions.append('xmso')
+                if save_xmsi: extensions.append('xmsi')
+                for extension in extensions:
+                    file = '{}.{}'.format(staging, extension)
+                    if extension == 'xmsi':
+                        #the kept input names its output where it ends up, not in the staging folder
+                        self.full_xmsi = s_header.format(destination) + self.full_xmsi[len(s_header.format(staging)):]
+                        with open(file, 'w') as f:
+                            f.write(self.full_xmsi)
+                    if cache is not None:
+                        cache.put(key, file, extension)
+                    else:
+                        move_file(file, '{}.{}'.format(destination, extension))
+            shutil.rmtree(os.path.dirname(staging), ignore_errors=True)
+            self.filelocation = destination
+            return
+        if not save_xmsi:
+            os.remove(self.filelocation+'.xmsi')
+        if not save_xmso:
+            os.remove(self.filelocation+'.xmso')
+
+    async def calculate_async(self, bands=None, timeout=None, semaphore=None, **kwargs):
+        """
+        asyncio version of calculate(), see xmimsim.calculate_async() for the details.
+        Returns a xmimsim.Result holding the spectrum (and the band counts if bands
+        is given, in the format of count_photons(**bands))
+        
+        results = await asyncio.gather(*[xm.calculate_async(timeout=600) for xm in models])
+        """
+        return await calculate_async(self, bands=bands, timeout=timeout, semaphore=semaphore, **kwargs)
      
                 
     def get_spectrum(self):
         """
         gets the spectrum and returns it for an arbitrary calculation
         
-        
+        returns a xmimsim.Spectrum, which can be used like the list of
+        [energy, counts, ...] rows this used to return (see spectrum.tolist()).
+        Read from the .xmso, it also holds the unconvoluted spectrum
+        """
+        with timed('parse', self):
+            try:
+                file = self.filelocation + '.csv'
+                self.spectrum = Spectrum.from_csv(file)
+            except:
+                try: 
+                    file = self.filelocation + '.xmso'
+                except: return None
+                else:
+                    try:
+                        self.spectrum = Spectrum.from_xmso(file)
+                        if len(self.spectrum) == 0: raise ValueError('spectrum is empty')
+                    except:
+                        print("critical error in data analysis: spectrum not found") #the xmso is missing, truncated or has no spectrum
+        if getattr(self, 'python_detector', False):
+            with timed('convolve', self):
+                self.spectrum = self.convolve(self.spectrum)
+        return self.spectrum
+
+    def convolve(self, spectrum):
+        """
+        Applies the detector response of the current detector parameters to the
+        unconvoluted spectrum of a python_detector calculation (see calculate())
+        and returns the convoluted xmimsim.Spectrum
+        """
+        unconvoluted = spectrum.unconvoluted if spectrum.unconvoluted is not None else spectrum.counts
+        p = self.parameters
+        energy, counts = convolve(spectrum.energy, unconvoluted, p['detector_gain'], p['detector_zero'],
+                                  p['detector_fano'], p['detector_noise'], p['detector_nchannels'],
+                                  p.get('detector_type', 'SiLi'))
+        return Spectrum(energy, counts, metadata=dict(spectrum.metadata, python_detector=True))
+
+    def realizations(self, n, pile_up=False, dead_time=False, seed=None):
+        """
+        n Poisson noise realizations of the calculated spectrum as an (n, channels)
+        array, without running XMI-MSIM again. pile_up and dead_time use
+        detector_live_time and detector_pulse_width, see xmimsim.realizations()
         """
         try:
-            file = self.filelocation + '.csv'
-            with open(file,'r') as filedata:                       
-                self.spectrum = [[float(j) for j in re.findall(r'(?<=\,)[^\,]+',line)] for line in filedata.readlines()]
+            self.spectrum
         except:
-            try: 
-                file = self.filelocation + '.xmso'
-            except: return None
-            else:
-                tag = 'spectrum_conv' #use spectrum_unconv for a spectrum that does not have the detector convolution (not recommended)
-                try:
-                    with open(file,'r') as filedata:                       
-                        xml_output_spectrum = filedata.read().split('<'+tag+'>')[1].split('</'+tag+'>')[0] #cuts the interesting part out
-                    spec_x = re.compile(r'(?<=\<energy\>)[\d\.e\-\+]+').findall(xml_output_spectrum) #looking for x data
-                    spec_y = re.compile(r'(?<=\<counts interaction_number\=\"\d\"\>)[\d\.e\-\+]+').findall(xml_output_spectrum) #looking for y data
-                    spec_x, spec_y = [[float (j) for j in i] for i in [spec_x,spec_y]]
-                    y_width = len(spec_y)//len(spec_x)
-                    self.spectrum = [[i,*spec_y[y_width*n:y_width*(n+1)]] for n,i in enumerate(spec_x)]
-                except:
-                    print("critical error in data analysis: spectrum not found") #not good if the x and y are different lengths, that means something is wrong with the last 4 lines of code above
-        return self.spectrum
+            self.get_spectrum()
+        if not isinstance(self.spectrum, Spectrum):
+            self.spectrum = Spectrum.from_rows(self.spectrum)
+        return realizations(self.spectrum, n, self.parameters.get('detector_live_time'),
+                            self.parameters.get('detector_pulse_width'), pile_up_model=pile_up,
+                            dead_time=dead_time, seed=seed)
 
     def count_photons(self,*args,**kwargs):
         """
@@ -543,6 +828,9 @@ class model():
         
         runs by default on unconvoluted spectra
         
+        if more than one interaction per trajectory was simulated, the counts up to
+        the highest interaction order (the last column of the spectrum) are used
+        
         Warning
         -------------
         Requires running .calculate() first, however, if force_overwrite = False and you
@@ -554,19 +842,9 @@ class model():
             self.spectrum
         except:
             self.get_spectrum()
+        if not isinstance(self.spectrum, Spectrum):
+            self.spectrum = Spectrum.from_rows(self.spectrum)
         if len([*args])>0:
-            span=[*args]
-            counts = sum([int(y) for [x,y] in self.spectrum if min(span) <= x <= max(span)])
-            return counts
+            return self.spectrum.photons(min(args), max(args))
         else:
-            output_dict = {}
-            for name,span in kwargs.items():
-                counts = sum([int(y) for [x,y] in self.spectrum if min(span) <= x <= max(span)])
-                output_dict.update({name:counts})
-            return output_dict                                
-        
-        
-        
-            
-        
-  
+            return {name:self.spectrum.photons(min(span), max(span)) for name,span in kwargs.items()}
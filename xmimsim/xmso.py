@@ -0,0 +1,82 @@
+import xml.etree.ElementTree as ET
+
+
+SPECTRA = ('spectrum_conv', 'spectrum_unconv')
+HISTORIES = ('brute_force_history', 'variance_reduction_history')
+
+
+def _interaction_counts(element):
+    """{interaction number: counts} of the <counts interaction_number=...> children"""
+    counts = {}
+    for child in element:
+        if 'interaction_number' in child.attrib:
+            value = child.attrib.get('counts', child.text)
+            counts[int(child.attrib['interaction_number'])] = float(value)
+    return counts
+
+
+def iter_xmso(file):
+    """
+    Walks through a .xmso file in one pass without holding it in memory
+    
+    Yields (kind, data) tuples as it goes:
+     ('metadata', {name: value}) for the attributes of the root element and the
+      fields in the <general> section of the input
+     ('spectrum_conv', [energy, counts interaction 1, ...]) for every channel
+     ('spectrum_unconv', [energy, counts interaction 1, ...]) for every channel
+     ('brute_force_history', (atomic_number, line, {interaction: counts}))
+     ('variance_reduction_history', (atomic_number, line, {interaction: counts}))
+    
+    Every element is discarded once it's been read, so memory use does not grow
+    with the size of the file.
+    """
+    stack = []
+    for event, element in ET.iterparse(file, events=('start', 'end')):
+        if event == 'start':
+            stack.append(element)
+            if len(stack) == 1:
+                yield 'metadata', dict(element.attrib)
+            continue
+        stack.pop()
+        parent = stack[-1].tag if stack else None
+        if element.tag == 'channel' and parent in SPECTRA:
+            counts = _interaction_counts(element)
+            yield parent, [float(element.findtext('energy')), *[counts[k] for k in sorted(counts)]]
+            element.clear()
+        elif element.tag == 'fluorescence_line_counts' and parent in HISTORIES:
+            atomic_number = int(element.attrib['atomic_number'])
+            for line in element:
+                yield parent, (atomic_number, line.attrib.get('type'), _interaction_counts(line))
+            element.clear()
+        elif parent == 'general' and len(element) == 0:
+            yield 'metadata', {element.tag: element.text}
+        if len(stack) == 1:
+            # done with a top level section, drop it from the tree
+            stack[0].clear()
+
+
+def read_xmso(file, histories=True):
+    """
+    Reads a .xmso file in a single streaming pass (see iter_xmso())
+    
+    Returns a dictionary with
+     'spectrum_conv' and 'spectrum_unconv': lists of
+      [energy, counts interaction 1, counts interaction 2, ...] rows, i.e. the
+      format returned by model.get_spectrum()
+     'brute_force_history' and 'variance_reduction_history': the counts per
+      fluorescence line and interaction, as {atomic number: {line: {interaction: counts}}}
+      (only if histories=True)
+     'metadata': version of the results and the <general> input fields
+    """
+    results = {'metadata': {}, **{tag: [] for tag in SPECTRA}}
+    if histories:
+        results.update({tag: {} for tag in HISTORIES})
+    for kind, data in iter_xmso(file):
+        if kind == 'metadata':
+            results['metadata'].update(data)
+        elif kind in SPECTRA:
+            results[kind].append(data)
+        elif histories:
+            atomic_number, line, counts = data
+            results[kind].setdefault(atomic_number, {})[line] = counts
+    return results